@@ -1,3 +1,8 @@
+__version__ = '0.4'
+
 from .language import *
 from .styles import *
+from .include import Fragment
 from .tikzpicture import TikzPicture
+from .convert import render, render_svg
+from .stats import Stats
@@ -0,0 +1,176 @@
+import os
+import sys
+import json
+import pickle
+import hashlib
+import warnings
+
+from . import __version__
+from .include import dependencies_fresh
+
+CACHE_DIR = '__annexcache__'
+PARSED_SUFFIX = '.parsed.pickle'
+
+
+class BuildCache:
+    """Records which inputs produced an output file.
+
+    For each output file, a small stamp file holds a hash of everything
+    that influences the output: the annex source, the annex_custom.py
+    source, the annexlang version and the effective TikzPicture options.
+    The stamp also lists the files included with !include and their
+    digests, which are checked as well. If the stamp matches, the output
+    file is left untouched (and keeps its mtime, so that latexmk & co.
+    do not rebuild the document).
+
+    By default, the stamps are kept in a __annexcache__ directory next
+    to each output file.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+
+    def stamp_filename(self, outfile):
+        if self.directory is None:
+            return os.path.join(os.path.dirname(outfile), CACHE_DIR, os.path.basename(outfile) + '.key')
+        name = hashlib.sha256(os.path.abspath(outfile).encode()).hexdigest()
+        return os.path.join(self.directory, name + '.key')
+
+    @staticmethod
+    def key(src, custom_objects_filename, options):
+        h = hashlib.sha256()
+        h.update(__version__.encode())
+        h.update(b'\0')
+        h.update(src.encode())
+        h.update(b'\0')
+        if custom_objects_filename is not None and os.path.exists(custom_objects_filename):
+            with open(custom_objects_filename, 'rb') as f:
+                h.update(f.read())
+        h.update(b'\0')
+        h.update(json.dumps(options, sort_keys=True, default=repr).encode())
+        return h.hexdigest()
+
+    def is_fresh(self, outfile, key, includes=None):
+        """Whether `outfile` is up to date for `key`.
+
+        If so, the files it includes are added to the dict `includes`, if given.
+        """
+        if not os.path.exists(outfile):
+            return False
+        try:
+            with open(self.stamp_filename(outfile), 'r') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return False
+        if not lines or lines[0].strip() != key:
+            return False
+        stored_includes = dict(reversed(line.split(' ', 1)) for line in lines[1:])
+        if not dependencies_fresh(stored_includes):
+            return False
+        if includes is not None:
+            includes.update(stored_includes)
+        return True
+
+    def invalidate(self, outfile):
+        try:
+            os.remove(self.stamp_filename(outfile))
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+
+    def store(self, outfile, key, includes=None):
+        # without a stamp, the output is just converted again next time
+        filename = self.stamp_filename(outfile)
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, 'w') as f:
+                f.write(key)
+                for path, digest in (includes or {}).items():
+                    f.write(f"\n{digest} {path}")
+        except OSError as e:
+            warnings.warn(f"cannot write the build cache for {outfile}: {e}")
+
+
+class ParseCache:
+    """Keeps the parsed annex files, so that unchanged files need not be parsed again.
+
+    Parsing (the YAML parser and constructing the protocol objects)
+    dominates the conversion of large files. The objects constructed
+    from an annex file are pickled, together with a hash of the annex
+    source, the annex_custom.py source, the annexlang and the Python
+    version. Files included with !include are stored with their
+    digests and checked as well. Options and styles are applied to the
+    objects after loading them from the cache, so they can change
+    freely.
+
+    Classes from plugins or from other modules imported by
+    annex_custom.py are not part of the hash; remove the cache files
+    after changing them. By default, the
+    cache files are kept in a __annexcache__ directory next to each
+    input file.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+
+    def filename(self, infile):
+        if self.directory is None:
+            return os.path.join(os.path.dirname(infile), CACHE_DIR, os.path.basename(infile) + PARSED_SUFFIX)
+        name = hashlib.sha256(os.path.abspath(infile).encode()).hexdigest()
+        return os.path.join(self.directory, name + PARSED_SUFFIX)
+
+    @staticmethod
+    def key(src, custom_objects_filename):
+        h = hashlib.sha256()
+        h.update(f"{__version__}\0{sys.version}\0".encode())
+        h.update(src.encode())
+        h.update(b'\0')
+        if custom_objects_filename is not None and os.path.exists(custom_objects_filename):
+            with open(custom_objects_filename, 'rb') as f:
+                h.update(f.read())
+        return h.hexdigest()
+
+    def get(self, infile, key, includes=None):
+        """The objects stored for `infile` under `key`, or None.
+
+        The files they include are added to the dict `includes`, if given.
+        """
+        try:
+            with open(self.filename(infile), 'rb') as f:
+                stored_key, stored_includes = pickle.load(f)
+                if stored_key != key or not dependencies_fresh(stored_includes):
+                    return None
+                parsed = pickle.load(f)
+        except Exception:  # no cache file, truncated file, classes that no longer exist, ...
+            return None
+        if includes is not None:
+            includes.update(stored_includes)
+        return parsed
+
+    def store(self, infile, key, parsed, includes=None):
+        """Store the objects parsed from `infile`.
+
+        The cache is only an optimization: if it cannot be written (e.g.,
+        in a read-only tree or for objects that cannot be pickled), a
+        warning is issued and the conversion goes on.
+        """
+        filename = self.filename(infile)
+        tmpname = f"{filename}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(tmpname, 'wb') as f:
+                pickle.dump((key, includes or {}), f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(parsed, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpname, filename)
+        except (OSError, pickle.PicklingError, TypeError, AttributeError, RecursionError) as e:
+            self.remove(tmpname)
+            warnings.warn(f"cannot write the parse cache for {infile}: {e}")
+        except BaseException:
+            self.remove(tmpname)
+            raise
+
+    @staticmethod
+    def remove(filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
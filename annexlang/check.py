@@ -0,0 +1,259 @@
+import os
+import re
+
+import yaml
+
+from .components import ProtocolStep, MultiStep, Protocol, Party, Group, VerticalSpace, object_numbering
+from .language import (GenericMessage, PostMessage, Action, ScriptAction, EndParty, DummyParty,
+                       OpenWindowStartParty, CloseWindowEndParty)
+from .convert import load_custom_objects, CUSTOM_OBJECTS_FILE
+from .loader import AnnexLoader
+from .steptable import StepTable, STARTS_PARTY, ENDS_PARTY, DUMMY_PARTY
+from .styles import AnnexStyle
+
+# Attributes referring to parties that steps of these types need (the
+# first matching type counts). Messages with reply_to take their parties
+# from the message they reply to.
+REQUIRED_PARTIES = (
+    (OpenWindowStartParty, ('src', 'dest')),
+    (CloseWindowEndParty, ('src', 'dest')),
+    (ScriptAction, ('src', 'dest')),
+    (GenericMessage, ('src', 'dest')),
+    (PostMessage, ('src', 'dest')),
+    ((Action, EndParty, DummyParty, VerticalSpace), ('party',)),
+)
+PARTY_ATTRIBUTES = ('party', 'src', 'dest')
+STYLE_ATTRIBUTES = ('style', 'text_style', 'note_style', 'lifeline_style')
+
+_style_definition = re.compile(r'([\w ]+)/\.style')
+
+
+class MarkingLoader(AnnexLoader):
+    """AnnexLoader that remembers the line in which each annex object starts.
+
+    Steps copied from fragments (see include.py) get the line of their
+    !include; their file and line in the fragment are kept in origins.
+    """
+
+    def __init__(self, stream):
+        super().__init__(stream)
+        self.lines = {}
+        self.origins = {}
+
+    def construct_yaml_object(self, node, cls):
+        objects = super().construct_yaml_object(node, cls)
+        data = next(objects)
+        self.lines[id(data)] = node.start_mark.line + 1
+        yield data
+        yield from objects
+
+    def construct_object(self, node, deep=False):
+        data = super().construct_object(node, deep)
+        if node.tag == '!include' and isinstance(data, ProtocolStep) and id(data) not in self.lines:
+            self.mark_fragment(node, data)
+        return data
+
+    def mark_fragment(self, node, step):
+        line = node.start_mark.line + 1
+        for copy in step.walk():
+            self.lines[id(copy)] = line
+        filename = next((value.value for key, value in node.value if key.value == 'file'), None)
+        filename = os.path.join(getattr(self, 'directory', None) or '', str(filename))
+        # parse the fragment again to find the lines of its steps; the copies
+        # have the same structure as the steps of the fragment
+        with open(filename, 'r') as f:
+            loader = MarkingLoader(f.read())
+        loader.directory = os.path.dirname(filename)
+        try:
+            with object_numbering():
+                fragment = loader.get_single_data()['fragment']
+        finally:
+            loader.dispose()
+        for original, copy in zip(fragment.walk(), step.walk()):
+            self.origins[id(copy)] = loader.origins.get(id(original), (filename, loader.lines.get(id(original))))
+
+
+def check(src, directory=None):
+    """Check annex source code for mistakes that would otherwise only show up as TeX errors.
+
+    Runs one pass over the parsed protocol, without drawing it. Returns
+    a list of (line, message) tuples, where line is the line in `src`
+    of the object with the problem (or None if unknown). Files included
+    with !include are relative to `directory`.
+    """
+    loader = MarkingLoader(src)
+    loader.directory = directory
+    try:
+        with object_numbering():
+            parsed = loader.get_single_data()
+    except yaml.MarkedYAMLError as e:
+        mark = e.problem_mark or e.context_mark
+        return [(mark.line + 1 if mark is not None else None, e.problem or str(e))]
+    except Exception as e:
+        return [(None, str(e))]
+    finally:
+        loader.dispose()
+    return Checker(loader.lines, loader.origins).check(parsed)
+
+
+def check_file(infile):
+    """Like check(), for the annex file `infile` (and the annex_custom.py next to it)."""
+    try:
+        load_custom_objects(os.path.dirname(infile))
+    except Exception as e:
+        return [(None, f"{CUSTOM_OBJECTS_FILE}: {e!r}")]
+    with open(infile, 'r') as f:
+        return check(f.read(), os.path.dirname(infile))
+
+
+class Checker:
+    def __init__(self, lines, origins=None):
+        self.lines = lines
+        self.origins = origins or {}
+        self.problems = []
+
+    def report(self, obj, message):
+        if id(obj) in self.origins:
+            filename, line = self.origins[id(obj)]
+            message += f" (in {filename}, line {line})"
+        self.problems.append((self.lines.get(id(obj)), message))
+
+    def check(self, parsed):
+        if not isinstance(parsed, dict) or not isinstance(parsed.get('protocol'), Protocol):
+            self.report(None, "expected a mapping with a !Protocol under 'protocol'")
+            return self.problems
+        options = parsed.get('options') or {}
+        self.defined_styles = self.check_styles(options.get('styles', []))
+        protocol = parsed['protocol']
+        self.parties = self.check_parties(protocol)
+        self.check_steps(protocol)
+        return self.problems
+
+    def check_styles(self, styles):
+        # returns the names of the TikZ styles defined by the styles
+        defined = set()
+        for style in styles:
+            if not isinstance(style, AnnexStyle):
+                self.report(style, f"not a style: {style!r}")
+                continue
+            defined.update(name.strip() for name in _style_definition.findall(getattr(style, 'style', '')))
+            try:
+                style.get_style()
+            except Exception as e:
+                self.report(style, str(e))
+        return defined
+
+    def check_style_names(self, obj, attribute, value):
+        # only annex_ styles can be told apart from other TikZ options
+        for option in str(value).split(','):
+            name = option.split('=')[0].strip()
+            if name.startswith('annex_') and name not in self.defined_styles:
+                self.report(obj, f"unknown style '{name}' in {attribute}")
+
+    def check_parties(self, protocol):
+        parties = getattr(protocol, 'parties', None) or []
+        if not parties:
+            self.report(protocol, "protocol without parties")
+        known = set()
+        for party in parties:
+            if not isinstance(party, Party):
+                self.report(party, f"not a party: {party!r}")
+                continue
+            known.add(id(party))
+            if not hasattr(party, 'name'):
+                self.report(party, "party without a name")
+            self.check_style_names(party, 'style', party.style)
+        for party in parties:
+            if isinstance(party, Party) and isinstance(party.column, Party) and id(party.column) not in known:
+                self.report(party, f"column of {self.name(party)} refers to a party that is not in the protocol")
+        for group in (protocol.groups if protocol.has_groups else []):
+            if not isinstance(group, Group):
+                self.report(group, f"not a group: {group!r}")
+                continue
+            if not getattr(group, 'parties', None):
+                self.report(group, "group without parties")
+                continue
+            for party in group.parties:
+                if id(party) not in known:
+                    self.report(group, f"{self.name(party)} in group is not a party of the protocol (and has no column)")
+        return known
+
+    @staticmethod
+    def name(party):
+        if isinstance(party, Party):
+            return f"party '{getattr(party, 'name', party.annexid)}'"
+        return repr(party)
+
+    def check_steps(self, protocol):
+        ids = {}
+        started = {}
+        seen = set()
+        stack = [iter(protocol.steps)]
+        while stack:
+            step = next(stack[-1], None)
+            if step is None:
+                stack.pop()
+                continue
+            if not isinstance(step, ProtocolStep):
+                self.report(step, f"not a protocol step: {step!r}")
+                continue
+            seen.add(id(step))
+            if getattr(step, 'id', False):
+                if step.id in ids:
+                    self.report(step, f"duplicate id '{step.id}' (first used in line {self.lines.get(id(ids[step.id]))})")
+                else:
+                    ids[step.id] = step
+            for attribute in STYLE_ATTRIBUTES:
+                if attribute in vars(step):
+                    self.check_style_names(step, attribute, vars(step)[attribute])
+            if isinstance(step, MultiStep):
+                if not isinstance(getattr(step, 'steps', None), list):
+                    self.report(step, "expected a list of steps")
+                else:
+                    stack.append(iter(step.steps))
+            else:
+                self.check_step_parties(step, seen)
+            self.check_lifeline(step, started)
+        for party, step in started.values():
+            self.report(step, f"started {self.name(party)}, but did not end it")
+
+    def check_step_parties(self, step, seen):
+        required = ()
+        for types, attributes in REQUIRED_PARTIES:
+            if isinstance(step, types):
+                required = attributes
+                break
+        if hasattr(step, 'reply_to'):
+            target = step.reply_to
+            if not isinstance(target, (GenericMessage, PostMessage)):
+                self.report(step, f"reply_to must refer to a message, not {target!r}")
+            elif id(target) not in seen:
+                self.report(step, "reply_to must refer to an earlier message")
+            required = tuple(a for a in required if a not in ('src', 'dest'))
+        for attribute in PARTY_ATTRIBUTES:
+            if attribute not in vars(step):
+                if attribute in required:
+                    self.report(step, f"{type(step).__name__} without {attribute}")
+                continue
+            party = vars(step)[attribute]
+            if id(party) not in self.parties:
+                self.report(step, f"{attribute}: {self.name(party)} is not a party of the protocol (and has no column)")
+
+    def check_lifeline(self, step, started):
+        flags = StepTable.step_flags(step)
+        if flags & DUMMY_PARTY or not flags & (STARTS_PARTY | ENDS_PARTY):
+            return
+        # opening and closing windows start and end their dest
+        party = vars(step).get('party', vars(step).get('dest'))
+        if party is None:
+            return
+        if flags & STARTS_PARTY:
+            if id(party) in started:
+                self.report(step, f"started {self.name(party)} that was already started "
+                                  f"in line {self.lines.get(id(started[id(party)][1]))}")
+            else:
+                started[id(party)] = (party, step)
+        elif id(party) not in started:
+            self.report(step, f"ended {self.name(party)} that was not started")
+        else:
+            del started[id(party)]
@@ -1,8 +1,62 @@
 import yaml
-from itertools import chain
+from itertools import chain, count as _id_count
 import re
+import warnings
+from contextlib import contextmanager
+from contextvars import ContextVar
 
-object_counter = 0
+from .loader import yaml_loaders, add_constructor, add_implicit_resolver
+from .lifelines import LifelineStyles, clip_segments
+from .nodes import NodeRegistry
+from .steptable import StepTable, STARTS_PARTY, ENDS_PARTY, DUMMY_PARTY, LIFELINE_STYLE
+from .profiles import get_profile
+
+# Numbers used in the annexids of new objects. Each document loaded within
+# object_numbering() gets its own numbering (starting at 1), which keeps the
+# ids independent of other documents loaded before or concurrently. Outside
+# of object_numbering(), a process-wide counter is used.
+_object_counter = ContextVar('annex_object_counter', default=None)
+_global_object_counter = _id_count(1)
+
+
+@contextmanager
+def object_numbering():
+    token = _object_counter.set(_id_count(1))
+    try:
+        yield
+    finally:
+        _object_counter.reset(token)
+
+
+_ex_length = re.compile(r'^(-?\d*\.?\d+)ex$')
+
+
+def ex_length(length):
+    """Value of a length like '2ex+2ex+1.6ex' in ex, or None for other lengths."""
+    total = 0.0
+    for term in str(length).replace(' ', '').split('+'):
+        m = _ex_length.match(term)
+        if not m:
+            return None
+        total += float(m.group(1))
+    return total
+
+
+def fold_height(height):
+    """Fold a sum of ex lengths in a height (length, anchor), e.g., ('2ex+1.6ex', 'north') -> ('3.6ex', 'north')."""
+    if not isinstance(height, (tuple, list)) or len(height) != 2 or '+' not in str(height[0]):
+        return height
+    value = ex_length(height[0])
+    if value is None:
+        return height
+    return f"{round(value, 4):g}ex", height[1]
+
+
+def split_lines(text):
+    text = str(text).strip()
+    if not text:
+        return []
+    return text.replace(r"\\\\", "\n").split("\n")
 
 
 # We use this counter to number the protocol steps. The counter can be manually set to a different value.
@@ -40,12 +94,13 @@ class cached_property(object):
 
     
 class ProtocolObject(yaml.YAMLObject):
+    yaml_loader = yaml_loaders()
+
     def __new__(cls):
-        global object_counter
-        object_counter += 1
+        counter = _object_counter.get() or _global_object_counter
 
         obj = super().__new__(cls)
-        obj.annexid = "{}_{}".format(cls.__name__, object_counter)
+        obj.annexid = "{}_{}".format(cls.__name__, next(counter))
 
         return obj
 
@@ -57,11 +112,16 @@ class ProtocolObject(yaml.YAMLObject):
         return f"""<{self.annexid}>"""
 
     
+# Attributes set by the passes of Protocol.init() for their own use; they
+# are left out of the attributes shown by the debug profile.
+INTERNAL_ATTRIBUTES = frozenset(('_index', '_index_end', 'node_registry', 'table', 'lifelines', 'lifeline_blocks',
+                                 'visible_half_lines', 'lines_above', 'lines_below', 'matrix_height'))
+
+
 class ProtocolStep(ProtocolObject):
     node_name_counter = 0
     skip_number = 0
     text_style = "annex_arrow_text"
-    _affecting_nodes = []
     style = ""
     note_style = ""
     counter = None  # manually set number of this protocol step, if any
@@ -69,8 +129,19 @@ class ProtocolStep(ProtocolObject):
     def length(self):
         return 1
 
-    def tikz_desc(self):
-        return f"""% drawing node of type {self.__class__.__name__} in matrix line {self.line} with attributes: {self.__dict__!r}"""
+    def tikz_desc(self, verbose=True):
+        if not verbose:
+            return f"""% {self.__class__.__name__} {self.annexid} in matrix line {self.line}"""
+        return f"""% drawing node of type {self.__class__.__name__} in matrix line {self.line} with attributes: {self.debug_attributes()!r}"""
+
+    def debug_attributes(self):
+        return {key: value for key, value in vars(self).items() if key not in INTERNAL_ATTRIBUTES}
+
+    def debug_pin(self, pin):
+        # invisible pin showing debug information, unless disabled by the emission profile
+        if not get_profile(self.protocol.options)['debug_pins']:
+            return ''
+        return f",pin={{{pin}}}"
 
     def tikz(self):
         return ""
@@ -84,6 +155,13 @@ class ProtocolStep(ProtocolObject):
     def tikz_markers(self):
         return ''
 
+    def svg(self, svg):
+        # draw this step into an SvgPicture (see svg.py)
+        pass
+
+    def svg_markers(self, svg):
+        pass
+
     def contour(self, text):
         c = getattr(self, 'draw_contour', True)
         if not c:
@@ -109,12 +187,15 @@ class ProtocolStep(ProtocolObject):
 
     @cached_property
     def tikz_above(self):
+        self.check_texts()
         if not self.text_above and (not getattr(self, 'id_above', True) or not self.tex_id):
             return ""
         else:
-            return r"""node [%s,above=2.6pt,anchor=base,pin={[pin distance=-8pt,pin edge={draw=none},annex_debug]90:%s}](%s){%s%s}""" % (
+            return r"""node [%s,above=2.6pt,anchor=base%s](%s){%s%s}""" % (
                 self.text_style,
-                self.id.replace("_", r"\_") if getattr(self, 'id', False) else '',
+                self.debug_pin(r"[pin distance=-8pt,pin edge={draw=none},annex_debug]90:%s" % (
+                    self.id.replace("_", r"\_") if getattr(self, 'id', False) else '',
+                )),
                 self.create_affecting_node_name(parties=[]),
                 self.tex_id if getattr(self, 'id_above', False) else '',
                 self.contour(r'\\'.join(self.lines_above))
@@ -122,6 +203,7 @@ class ProtocolStep(ProtocolObject):
 
     @cached_property
     def tikz_below(self):
+        self.check_texts()
         if not self.text_below:
             return ""
         else:
@@ -141,13 +223,13 @@ class ProtocolStep(ProtocolObject):
     def create_affecting_node_name(self, parties=None):
         name = f"{self.annexid}_{self.node_name_counter}"
         self.node_name_counter += 1
-        self._affecting_nodes = self._affecting_nodes + [name]
 
         if parties is None:
             parties = self.affected_parties
-        for p in parties:
-            p.add_affecting_node(name)
-        return name
+        return self.add_affecting_node(name, parties)
+
+    def add_affecting_node(self, name, parties=()):
+        return self.protocol.node_registry.add(self._index, name, parties)
 
     def _init(self, protocol, counter, skip_number):
         self.protocol = protocol
@@ -170,6 +252,13 @@ class ProtocolStep(ProtocolObject):
         self.line = line
         return 1
 
+    def set_index(self, index):
+        # Number the steps in pre-order; the steps in the subtree of this
+        # step have indices self._index, ..., self._index_end - 1.
+        self._index = index
+        self._index_end = index + 1
+        return self._index_end
+
     def walk(self):
         yield self
 
@@ -179,22 +268,33 @@ class ProtocolStep(ProtocolObject):
 
     @property
     def affecting_nodes(self):
-        return list(self._affecting_nodes)
-
-    @property
-    def lines_below(self):
-        if self.text_below.strip():
-            return self.text_below.strip().replace(r"\\\\", "\n").split("\n")
+        return self.protocol.node_registry.step_nodes(self._index)
+
+    def layout(self):
+        # Called once for each step after _init() (see Protocol.init_layout()).
+        # Computes what the emitters read, so they don't depend on the order
+        # in which they run. Steps that change their texts have to do so in
+        # _init() or in layout(), before calling this.
+        self.lines_above = split_lines(getattr(self, 'text_above', ''))
+        self.lines_below = split_lines(getattr(self, 'text_below', ''))
+        self.tex_id  # cached from now on
+        if hasattr(self, 'height_overwrite'):
+            height = self.height_overwrite
         else:
-            return list()
+            height = getattr(self, 'height', None)
+        self.matrix_height = fold_height(height)
+
+    def check_texts(self):
+        # Texts set after layout() (e.g., in tikz()) are not part of the
+        # layout; draw them anyway, but tell the author.
+        lines_above = split_lines(getattr(self, 'text_above', ''))
+        lines_below = split_lines(getattr(self, 'text_below', ''))
+        if lines_above != self.lines_above or lines_below != self.lines_below:
+            warnings.warn(f"{type(self).__name__} {self.annexid} changed text_above/text_below after layout(); "
+                          f"set them in layout() before calling super().layout()")
+            self.lines_above = lines_above
+            self.lines_below = lines_below
 
-    @property
-    def lines_above(self):
-        if self.text_above.strip():
-            return self.text_above.strip().replace(r"\\\\", "\n").split("\n")
-        else:
-            return list()
-        
     
 class MultiStep(ProtocolStep):
     skip_number = True
@@ -212,13 +312,15 @@ class MultiStep(ProtocolStep):
         for step in self.steps:
             step._init(protocol, counter, skip_inner_numbers)
 
+    def layout(self):
+        super().layout()
+        if (self.condense or hasattr(self, "label")) and type(self.condense) is not str:
+            self.condense = 'north west'
+
     def tikz_markers(self):
         if not self.condense and not hasattr(self, "label"):
             return ""
 
-        if type(self.condense) is not str:
-            self.condense = 'north west'
-
         fit_string = "fit=" + ''.join(f'({x})' for x in self.affecting_nodes)
         gid = self.annexid
         out = fr"""\node[annex_condensed_box,{fit_string}]({gid}) {{}}; """
@@ -227,7 +329,34 @@ class MultiStep(ProtocolStep):
             label_pos = getattr(self, "label_pos", "north east")
             out += fr"\node[annex_multistep_caption_text,anchor={label_pos}] at ({gid}.{label_pos}) {{{self.contour(self.label)}}};"
         return out
+
+    def svg_markers(self, svg):
+        if not self.condense and not hasattr(self, "label"):
+            return
+        box = svg.subtree_box(self)
+        if box is None:
+            return
+        box = svg.fit([box], inner_sep='1pt')
+        svg.rect(box, 'annex_condensed_box', rounded=svg.length('1ex', 0), layer='markers')
+        number = svg.step_number(self)
+        if number:
+            x, y = box.anchor(self.condense)
+            svg.number(x, y, number, align='middle', layer='markers')
+        if hasattr(self, "label"):
+            label_pos = getattr(self, "label_pos", "north east")
+            x, y = box.anchor(label_pos)
+            align = 'end' if 'east' in label_pos else 'start' if 'west' in label_pos else 'middle'
+            valign = 'top' if 'north' in label_pos else 'bottom' if 'south' in label_pos else 'middle'
+            svg.text(x, y, str(self.label), 'annex_multistep_caption_text', align=align, valign=valign, layer='markers')
         
+    def set_index(self, index):
+        self._index = index
+        index += 1
+        for step in self.steps:
+            index = step.set_index(index)
+        self._index_end = index
+        return index
+
     def walk(self):
         yield self
         for step in self.steps:
@@ -240,7 +369,7 @@ class MultiStep(ProtocolStep):
 
     @property
     def affecting_nodes(self):
-        return chain(*(step.affecting_nodes for step in self.steps))
+        return self.protocol.node_registry.step_nodes(self._index + 1, self._index_end)
             
 
 class Parallel(MultiStep):
@@ -269,45 +398,33 @@ class Serial(MultiStep):
         self.length = length
         return length
 
-    def apply_lifeline_style(self):
-        block_start = self.line * 2
-        block_end = (self.line + self.length - 1) * 2
-        for step in self.protocol.walk():  # TODO: we need to walk over the whole protocol!!!!
-            if not hasattr(step, 'lifeline_segments'):
-                continue
-            for i, segment in zip(range(len(step.lifeline_segments)), step.lifeline_segments):
-                segment_start = segment[0]
-                segment_end = segment[1]
-                if segment_end <= block_start or segment_start >= block_end:
-                    continue
-
-                if segment[2] == self.lifeline_style:
-                    # segment does not need to be split up
-                    continue
-
-                # block affects segment -> split segment
-                if block_start > segment_start and block_end >= segment_end:
-                    # block affects the end of segment
-                    step.lifeline_segments = step.lifeline_segments[:i] + [(segment_start, block_start-1, segment[2]), (block_start-1, segment_end, self.lifeline_style)]
-                elif block_start <= segment_start and block_end < segment_end:
-                    # block affects start of segment
-                    step.lifeline_segments = [(segment_start, block_end + 1, self.lifeline_style), (block_end + 1, segment_end, segment[2])] + step.lifeline_segments[i+1:]
-                elif block_start <= segment_start and block_end >= segment_end:
-                    # block affects whole segment
-                    step.lifeline_segments = [(segment_start, segment_end, self.lifeline_style)]
-                elif block_start > segment_start and block_end < segment_end:
-                    # block affects middle of segment
-                    step.lifeline_segments = step.lifeline_segments[:i] + [(segment_start, block_start - 1, segment[2]), (block_start - 1, block_end + 1, self.lifeline_style), (block_end + 1, segment_end, segment[2])] + step.lifeline_segments[i+1:]
-
 
 class Protocol(Serial):
     yaml_tag = '!Protocol'
-    extra_steps = []
     counter = 0
-    columns = []
+    visible_half_lines = None  # set while rendering a page (see paginate.py)
+    table = None  # StepTable, set by init()
+
+    # init() runs these methods in order; benchmarks time them separately
+    init_phases = ('init_lines', 'init_steps', 'init_layout', 'init_table', 'init_lifelines', 'init_lifeline_styles')
+
+    def init(self, options, timer=None):
+        """Prepare the protocol for drawing with the given options.
 
-    def init(self, options):
+        `timer`, if given, is called with the name of each phase and
+        must return a context manager (e.g., to measure the phase).
+        """
         self.options = options
+        if options.get('stable_ids', False):
+            self.assign_stable_ids()
+        for phase in self.init_phases:
+            if timer is None:
+                getattr(self, phase)()
+            else:
+                with timer(phase):
+                    getattr(self, phase)()
+
+    def init_lines(self):
         # Set line numbers for each step
         self.set_line(1 if self.has_groups else 0)
 
@@ -323,34 +440,100 @@ class Protocol(Serial):
         for p in self.parties:
             if isinstance(p.column, Party):
                 p.column = p.column.column
-        
+            p.protocol = self
+
+    def init_steps(self):
+        # Number the steps and set up the registry for their nodes
+        self.node_registry = NodeRegistry(self.set_index(0))
 
         step_counter = count(start=0, step=1)
         next(step_counter)  # initialize counter, it is now at 1
         self._init(self, step_counter, False)
 
-        # determine start and end points of lifelines
-        last_starts = {}
+    def init_layout(self):
         for step in self.walk():
-            if getattr(step, 'dummyparty', False):
+            step.layout()
+
+    def init_table(self):
+        # all later passes iterate over the step table instead of the tree
+        self.table = None
+        self.table = StepTable(self)
+
+    def init_lifelines(self):
+        # determine start and end points of lifelines and the blocks with lifeline styles
+        last_starts = {}
+        lifelines = []
+        blocks = []
+        table = self.table
+        for i, flags in enumerate(table.flags):
+            if not flags & (STARTS_PARTY | ENDS_PARTY | LIFELINE_STYLE):
                 continue
-            elif getattr(step, 'startsparty', False):
+            step = table.steps[i]
+            if flags & LIFELINE_STYLE:
+                blocks.append((step.line, step.line + step.length - 1, step.lifeline_style))
+            if flags & DUMMY_PARTY:
+                continue
+            elif flags & STARTS_PARTY:
                 if step.party in last_starts:
                     raise Exception("Started party that was already started: " + repr(step.party))
                 last_starts[step.party] = step
-            elif getattr(step, 'endsparty', False):
+            elif flags & ENDS_PARTY:
                 if step.party not in last_starts:
                     raise Exception("Ended party that was not started: " + repr(step.party))
                 last_starts[step.party].end = step
-                last_starts[step.party].lifeline_segments = [(last_starts[step.party].line * 2, step.line * 2, "annex_lifeline")]
+                lifelines.append(last_starts[step.party])
                 del last_starts[step.party]
         if len(last_starts):
             raise Exception("Party was started but not ended: " + repr(last_starts))
-        # apply lifeline styles
-        for step in self.walk():
-            if getattr(step, 'lifeline_style', False):
-                step.apply_lifeline_style()
+        self.lifelines = lifelines
+        self.lifeline_blocks = blocks
+
+    def init_lifeline_styles(self):
+        styles = LifelineStyles(self.lifeline_blocks, self.line + self.length)
+        for start in self.lifelines:
+            start.lifeline_segments = styles.segments(start.line, start.end.line)
+
+    def walk(self):
+        if self.table is None:
+            return super().walk()
+        return self.table.walk()
+
+    def visible_segments(self, segments):
+        if self.visible_half_lines is None:
+            return segments
+        return clip_segments(segments, *self.visible_half_lines)
+
+
+    def assign_stable_ids(self):
+        # By default, annexids are numbered in the order in which the objects
+        # were loaded, so inserting one step changes the ids (and TikZ node
+        # names) of all following steps. Instead, derive the ids from the
+        # user-given ids of the steps or from their position in the protocol
+        # (e.g., the second step within the fourth top-level step gets "s3-1"),
+        # relative to the closest enclosing step with an id.
+        assigned = {}
+
+        def assign(obj, annexid):
+            if annexid in assigned:
+                raise Exception(f"Stable id '{annexid}' of {obj!r} collides with {assigned[annexid]!r}")
+            obj.annexid = annexid
+            assigned[annexid] = obj
+
+        def assign_steps(steps, prefix):
+            for i, step in enumerate(steps):
+                if getattr(step, 'id', False):
+                    assign(step, "id-" + re.sub(r'[^A-Za-z0-9_-]', '-', str(step.id)))
+                else:
+                    assign(step, f"{prefix}{i}")
+                if isinstance(step, MultiStep):
+                    assign_steps(step.steps, f"{step.annexid}-")
 
+        assign(self, "protocol")
+        for i, party in enumerate(self.parties):
+            assign(party, f"party{i}")
+        for i, group in enumerate(self.groups if self.has_groups else []):
+            assign(group, f"group{i}")
+        assign_steps(self.steps, "s")
 
     @property
     def has_groups(self):
@@ -362,40 +545,52 @@ class Party(ProtocolObject):
     style = ''
     column = None
 
-    def add_affecting_node(self, node):
-        if hasattr(self, '_affecting_nodes'):
-            self._affecting_nodes.append(node)
-        else:
-            self._affecting_nodes = [node]
-
     @property
     def fit_string(self):
-        if hasattr(self, '_affecting_nodes'):
-            return self._affecting_nodes
-        else:
-            return ()
+        return self.protocol.node_registry.party_nodes(self)
+
+    @property
+    def continued_node_name(self):
+        return f"{self.annexid}-continued"
+
+    def tikz_continued(self, line):
+        # repeats the party box at the top of a page (see paginate.py)
+        pos = self.get_pos(self.column, line)
+        return fr"""\node[name={self.continued_node_name},annex_start_party_box,{self.style}] at ({pos}) {{{self.name}}};"""
 
 
 class Group(ProtocolObject):
     yaml_tag = '!Group'
 
-    def tikz_desc(self):
+    def tikz_desc(self, verbose=True):
         return f"""% drawing group {self.name}"""
 
-    def tikz_groups(self, num_lines):
+    def tikz_groups(self, num_lines, page=None):
         columns_of_parties = {p.column:p for p in self.parties}
         first_column = min(columns_of_parties)
         first_party = columns_of_parties[first_column]
         last_column = max(columns_of_parties)
         last_party = columns_of_parties[last_column]
-        fit_string = "fit=" + ''.join(f'({x})' for x in chain(
-            [self.get_pos(first_column, 0)],
-            first_party.fit_string,
-            last_party.fit_string,
-        ))
+        if page is None:
+            nodes = chain(first_party.fit_string, last_party.fit_string)
+        else:
+            nodes = chain(page.party_nodes(first_party), page.party_nodes(last_party))
+        fit_string = "fit=" + ''.join(f'({x})' for x in chain([self.get_pos(first_column, 0)], nodes))
         gid = self.annexid
         return fr"""\node[annex_group_box,{fit_string}]({gid}) {{}}; \node[anchor=base,above=of {gid}.north,above=-2.5ex,anchor=base] {{{self.name}}};"""
 
+    def svg(self, svg):
+        columns_of_parties = {p.column:p for p in self.parties}
+        first_column = min(columns_of_parties)
+        last_column = max(columns_of_parties)
+        box = svg.fit([
+            svg.pos(first_column, 0),
+            svg.party_box(columns_of_parties[first_column]),
+            svg.party_box(columns_of_parties[last_column]),
+        ])
+        svg.rect(box, 'annex_group_box', rounded=svg.length('1ex', 0), layer='groups')
+        svg.text((box.x1 + box.x2) / 2, box.y1 + svg.length('2.5ex', 0), str(self.name), layer='groups')
+
 
 class Separator(ProtocolStep):
     skip_number = True
@@ -408,6 +603,11 @@ class Separator(ProtocolStep):
         out += super().tikz_arrows()
         return out
 
+    def svg(self, svg):
+        x1, y = svg.pos(self.protocol.parties[0].column, self.line)
+        x2, _ = svg.pos(self.protocol.parties[-1].column, self.line)
+        svg.line(x1, y, x2, y, svg.css('annex_separator', self.style))
+
     @property
     def height(self):
         return "2ex", "center"
@@ -432,6 +632,9 @@ class VerticalSpace(ProtocolStep):
         out = fr"""\node[annex_vertical_space,inner sep=0pt,name={self.node_name}] at ({pos}) {{}};"""
         return out
 
+    def svg(self, svg):
+        svg.mark(*svg.pos(self.party.column, self.line), parties=self.affected_parties)
+
     @property
     def height(self):
         return self.amount, self.valign
@@ -443,14 +646,22 @@ class Comment(ProtocolStep):
     skip_number = True
     text_style = 'annex_comment_text'
 
+    def layout(self):
+        self.text_below = str(self.label)
+        super().layout()
+
     def tikz_arrows(self):
         src = self.get_pos(self.protocol.parties[0].column, self.line)
         dest = self.get_pos(self.protocol.parties[-1].column, self.line)
-        self.text_below = str(self.label)
         out = fr"""%% draw comment
         \draw[draw=none] ({src}) to {self.tikz_below} ({dest});"""
         out += super().tikz_arrows()
         return out
+
+    def svg(self, svg):
+        x1, y = svg.pos(self.protocol.parties[0].column, self.line)
+        x2, _ = svg.pos(self.protocol.parties[-1].column, self.line)
+        svg.captions(self, (x1 + x2) / 2, y, above=[])
     
     @property
     def height(self):
@@ -461,6 +672,7 @@ class Comment(ProtocolStep):
         yield from []
 
         
-yaml.add_constructor('!separator', Separator.constructor)
+add_constructor('!separator', Separator.constructor)
 pattern = re.compile(r'^-{3,}$')
-yaml.add_implicit_resolver('!separator', pattern)
+# Only scalars starting with '-' need to be checked against the pattern.
+add_implicit_resolver('!separator', pattern, ['-'])
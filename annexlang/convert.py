@@ -0,0 +1,343 @@
+import os
+import sys
+import glob
+import hashlib
+import importlib.util
+import time
+import traceback
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+
+from .components import object_numbering
+from .loader import load
+from .tikzpicture import TikzPicture
+from .svg import SvgPicture
+from .cache import BuildCache, ParseCache
+from .externalize import figure_name
+from .include import is_fragment_file
+from .latex import compile_pdf, build_format, format_directory, preamble, DEFAULT_ENGINE
+from .styles import style_sheet_name, STYLE_SHEET_PREFIX
+
+CUSTOM_OBJECTS_FILE = 'annex_custom.py'
+INPUT_PATTERNS = ('*.yml', '*.yaml')
+OUTPUT_SUFFIX = '.tex'
+SVG_SUFFIX = '.svg'
+PDF_SUFFIX = '.pdf'
+DEBUG_SIDECAR_SUFFIX = '.debug.json'
+
+# annex_custom.py modules that were already executed in this process (i.e.,
+# in this batch worker), keyed by the absolute path of the file.
+_custom_modules = {}
+
+
+def custom_objects_filename(directory):
+    return os.path.abspath(os.path.join(directory, CUSTOM_OBJECTS_FILE))
+
+
+def load_custom_objects(directory, reload=False):
+    """Execute the annex_custom.py file in `directory`, if any.
+
+    Each file is only executed once per process; later calls return the
+    module object from the first call (or None if there is no such
+    file). With `reload`, the file is executed again, which registers
+    the YAML tags of the (changed) classes anew. The module is
+    registered in sys.modules under a name unique to the file, so that
+    objects of its classes can be pickled (see ParseCache).
+    """
+    filename = custom_objects_filename(directory)
+    if filename in _custom_modules and not reload:
+        return _custom_modules[filename]
+    module = None
+    if os.path.exists(filename):
+        name = f"annex_custom_{hashlib.sha256(filename.encode()).hexdigest()[:16]}"
+        spec = importlib.util.spec_from_file_location(name, filename)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            del sys.modules[name]
+            raise
+    _custom_modules[filename] = module
+    return module
+
+
+def convert(infile, outfile, cache=None, options=None, debug_sidecar=False, externalize=False, engine=DEFAULT_ENGINE,
+            timeout=None, memory_limit=None, stats=None, parse_cache=None, includes=None):
+    """Convert the annex file `infile` to the TikZ file `outfile`.
+
+    If `outfile` ends with .svg, an SVG preview is written instead; if
+    it ends with .pdf, the TikZ code is compiled to a standalone PDF
+    with the TeX `engine`, limited to `timeout` seconds and
+    `memory_limit` bytes (see latex.py).
+
+    `options` override the options given in the annex file. If a
+    BuildCache is given as `cache` and nothing changed since the last
+    conversion, `outfile` is not touched. With `debug_sidecar`, the
+    attributes of all steps are written to outfile + '.debug.json'.
+    With `externalize`, the figure is prepared for TikZ externalization
+    under a name derived from `outfile`. With the style_sheet option,
+    the styles are written to a shared style sheet in that directory
+    (see write_style_sheet()); for PDFs, they go into the LaTeX format.
+    If a Stats object is given as `stats`, it collects statistics about
+    the phases of the conversion. If a ParseCache is given as
+    `parse_cache`, unchanged annex files are loaded from there instead
+    of being parsed again. The files included with !include are added
+    to the dict `includes` (path -> digest), if given. Returns True if
+    `outfile` was written.
+    """
+    def phase(name):
+        return nullcontext() if stats is None else stats.phase(name)
+
+    pdf = outfile.endswith(PDF_SUFFIX)
+    picture = SvgPicture if outfile.endswith(SVG_SUFFIX) else TikzPicture
+    if externalize and picture is TikzPicture and not pdf:
+        options = dict(options or {}, externalize=figure_name(outfile))
+    directory = os.path.dirname(infile)
+    with phase('load custom objects'):
+        load_custom_objects(directory)
+
+    with open(infile, 'r') as inf:
+        src = inf.read()
+
+    if cache is not None:
+        key_options = dict(picture.options, **(options or {}))
+        if pdf:
+            key_options['engine'] = engine
+        key = cache.key(src, custom_objects_filename(directory), key_options)
+        if cache.is_fresh(outfile, key, includes):
+            return False
+        cache.invalidate(outfile)
+
+    if includes is None:
+        includes = {}  # files included with !include
+    parsed = None
+    if parse_cache is not None:
+        parse_key = parse_cache.key(src, custom_objects_filename(directory))
+        with phase('load parse cache'):
+            parsed = parse_cache.get(infile, parse_key, includes)
+    if parsed is None:
+        with object_numbering():
+            with phase('parse'):
+                parsed = load(src, directory, includes)
+        if isinstance(parsed, dict) and 'fragment' in parsed and 'protocol' not in parsed:
+            raise Exception(f"{infile} is a fragment, include it with !include in a diagram instead of converting it")
+        if parse_cache is not None:
+            with phase('store parse cache'):
+                parse_cache.store(infile, parse_key, parsed, includes)
+    t = picture(parsed, options, stats)
+    style_sheet = picture is TikzPicture and t.options['style_sheet']
+    if pdf:
+        format_dir = cache.directory if cache is not None else None
+        tikz = ''.join(t.chunks())
+        with phase('compile pdf'):
+            compile_pdf(tikz, outfile, engine, format_dir, t.style_sheet if style_sheet else '',
+                        timeout=timeout, memory_limit=memory_limit)
+    else:
+        if style_sheet:
+            write_style_sheet(style_sheet, t.style_string, t.style_sheet)
+        write_atomic(outfile, t.dump)
+    if debug_sidecar:
+        write_atomic(outfile + DEBUG_SIDECAR_SUFFIX, t.dump_debug)
+
+    if cache is not None:
+        cache.store(outfile, key, includes)
+    return True
+
+
+def extra_preamble(infile, options=None):
+    """The part of the LaTeX preamble for `infile` that compile_pdf() adds: its style sheet, if any."""
+    directory = os.path.dirname(infile)
+    load_custom_objects(directory)
+    with open(infile, 'r') as f:
+        src = f.read()
+    with object_numbering():
+        parsed = load(src, directory)
+    t = TikzPicture(parsed, options)
+    return t.style_sheet if t.options['style_sheet'] else ''
+
+
+def render(yaml_text, stats=None, **options):
+    """Convert annex source code to TikZ code and return it as a string.
+
+    `options` override the options given in the annex source. All state
+    is kept per call, so render() can be used from several threads at
+    the same time. Custom step classes need to be imported (or loaded
+    with load_custom_objects()) before. Files included with !include
+    are relative to the current directory. A Stats object given as
+    `stats` collects statistics about the phases of the conversion.
+    """
+    with object_numbering():
+        with nullcontext() if stats is None else stats.phase('parse'):
+            parsed = load(yaml_text)
+    return ''.join(TikzPicture(parsed, options, stats).chunks())
+
+
+def render_svg(yaml_text, stats=None, **options):
+    """Like render(), but return an SVG preview of the picture."""
+    with object_numbering():
+        with nullcontext() if stats is None else stats.phase('parse'):
+            parsed = load(yaml_text)
+    return SvgPicture(parsed, options, stats).render()
+
+
+def write_atomic(filename, write):
+    """Call write(f) on a temporary file which then replaces `filename`.
+
+    Readers of `filename` (e.g., a LaTeX run) never see a half-written file.
+    """
+    tmpname = f"{filename}.{os.getpid()}.tmp"
+    try:
+        with open(tmpname, 'w') as f:
+            write(f)
+        os.replace(tmpname, filename)
+    except BaseException:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+        raise
+
+
+def write_style_sheet(directory, style_string, tex):
+    """Write the style sheet `tex` for `style_string` to `directory`, unless it is there already.
+
+    Also updates the file annexstyles.tex in `directory` (see
+    write_style_index()).
+    """
+    os.makedirs(directory, exist_ok=True)
+    filename = os.path.join(directory, style_sheet_name(style_string) + OUTPUT_SUFFIX)
+    if not os.path.exists(filename):
+        write_atomic(filename, lambda f: f.write(tex))
+    write_style_index(directory)
+
+
+def write_style_index(directory):
+    """Write the file annexstyles.tex in `directory`, which loads all style sheets there.
+
+    Input it in the preamble of the document, so TeX parses the styles
+    only once instead of once per figure.
+    """
+    sheets = sorted(
+        entry[:-len(OUTPUT_SUFFIX)] for entry in os.listdir(directory)
+        if entry.startswith(STYLE_SHEET_PREFIX + '-') and entry.endswith(OUTPUT_SUFFIX)
+    )
+    write_atomic(os.path.join(directory, STYLE_SHEET_PREFIX + OUTPUT_SUFFIX),
+                 lambda f: f.writelines(f"\\input{{{directory}/{sheet}}}\n" for sheet in sheets))
+
+
+def find_inputs(paths):
+    """Expand files, directories (recursively) and glob patterns to a list of annex files.
+
+    Fragment files (see include.py) found in directories or with glob
+    patterns are skipped, they are only converted as part of the
+    diagrams including them.
+    """
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = []
+            for pattern in INPUT_PATTERNS:
+                matches += glob.glob(os.path.join(path, '**', pattern), recursive=True)
+            found += sorted(m for m in matches if not is_fragment_file(m))
+        elif glob.has_magic(path):
+            found += sorted(m for m in glob.glob(path, recursive=True) if not is_fragment_file(m))
+        else:
+            found.append(path)
+    # remove duplicates, keep order
+    return list(dict.fromkeys(found))
+
+
+def output_filename(infile, outdir=None, suffix=OUTPUT_SUFFIX, root=None):
+    """Name of the output file for `infile`, e.g., demo.yml -> demo.yml.tex
+
+    In `outdir`, the output file keeps the path of `infile` relative to
+    `root` (by default, the directory of `infile`).
+    """
+    outfile = infile + suffix
+    if outdir is not None:
+        outfile = os.path.join(outdir, os.path.relpath(os.path.abspath(outfile), root or os.path.dirname(os.path.abspath(infile))))
+    return outfile
+
+
+def output_filenames(infiles, outdir=None, suffix=OUTPUT_SUFFIX):
+    """Names of the output files for `infiles`.
+
+    In `outdir`, the output files keep the paths of the input files
+    relative to their common directory, so that, e.g., a/x.yml and
+    b/x.yml do not overwrite each other.
+    """
+    root = None
+    if outdir is not None and infiles:
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(infile)) for infile in infiles])
+    return [output_filename(infile, outdir, suffix, root) for infile in infiles]
+
+
+def _convert_job(infile, outfile, cache, kwargs):
+    # Runs in the worker processes. Exceptions are returned as strings
+    # since not all of them can be pickled.
+    start = time.perf_counter()
+    try:
+        written, error = convert(infile, outfile, cache, **kwargs), None
+    except Exception:
+        written, error = False, traceback.format_exc()
+    return written, error, time.perf_counter() - start
+
+
+def convert_batch(infiles, outdir=None, jobs=None, cache=None, suffix=OUTPUT_SUFFIX, **kwargs):
+    """Convert many annex files, using a pool of `jobs` worker processes.
+
+    `jobs` defaults to the number of CPU cores. A failing file does not
+    stop the conversion of the other files. Yields tuples (infile,
+    outfile, written, error, seconds) in the order in which the
+    conversions finish, where written tells whether the output file was
+    (re)written (see convert()), error is None on success or a formatted
+    traceback otherwise, and seconds is the time the conversion took.
+    The output files are named infile + `suffix` (use SVG_SUFFIX for SVG
+    previews, PDF_SUFFIX for PDFs), see output_filenames(). Further keyword arguments are passed
+    to convert().
+    """
+    jobs = jobs or os.cpu_count() or 1
+    tasks = list(zip(infiles, output_filenames(infiles, outdir, suffix)))
+    if outdir is not None:
+        for directory in {os.path.dirname(outfile) for infile, outfile in tasks}:
+            os.makedirs(directory, exist_ok=True)
+
+    if suffix == PDF_SUFFIX and tasks:
+        # Build the LaTeX formats up front instead of in all workers at once,
+        # with the styles of the first file (usually, all files use the same
+        # styles). Errors are reported for each file by the workers as well.
+        directory = cache.directory if cache is not None else None
+        try:
+            text = preamble(extra_preamble(tasks[0][0], kwargs.get('options')))
+        except Exception as e:
+            text = None
+            warnings.warn(f"cannot prepare the LaTeX format with the styles of {tasks[0][0]}: {e}")
+        for format_dir in ({format_directory(outfile, directory) for infile, outfile in tasks} if text else ()):
+            try:
+                build_format(kwargs.get('engine', DEFAULT_ENGINE), text, format_dir,
+                             kwargs.get('timeout'), kwargs.get('memory_limit'))
+            except Exception as e:
+                warnings.warn(f"cannot build the LaTeX format in {format_dir}: {e}")
+
+    if jobs == 1 or len(tasks) <= 1:
+        for infile, outfile in tasks:
+            yield (infile, outfile) + _convert_job(infile, outfile, cache, kwargs)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as pool:
+        futures = {
+            pool.submit(_convert_job, infile, outfile, cache, kwargs): (infile, outfile)
+            for infile, outfile in tasks
+        }
+        for future in as_completed(futures):
+            infile, outfile = futures[future]
+            try:
+                written, error, seconds = future.result()
+            except Exception:  # e.g., a worker process died
+                written, error, seconds = False, traceback.format_exc(), None
+            yield infile, outfile, written, error, seconds
+
+    # the workers update the index concurrently, so one of them may have missed another's sheet
+    style_sheet = (kwargs.get('options') or {}).get('style_sheet')
+    if style_sheet and suffix == OUTPUT_SUFFIX and os.path.isdir(style_sheet):
+        write_style_index(style_sheet)
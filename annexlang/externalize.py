@@ -0,0 +1,60 @@
+import os
+import re
+
+# Files written by TikZ' external library for each externalized figure
+EXTERNAL_SUFFIXES = ('.pdf', '.dpth', '.log', '.md5', '.dep')
+
+FINGERPRINT_LENGTH = 16
+
+_externalized_file = re.compile(r'^(.+)-[0-9a-f]{%d}$' % FINGERPRINT_LENGTH)
+_next_filename = re.compile(r'\\tikzsetnextfilename\{([^}]*)\}')
+
+
+def figure_name(filename):
+    """Figure name for an output file, e.g., 'figures/demo.yml.tex' -> 'demo-yml'"""
+    name = os.path.basename(filename)
+    if name.endswith('.tex'):
+        name = name[:-len('.tex')]
+    return re.sub(r'[^A-Za-z0-9_-]', '-', name)
+
+
+def figure_filename(name, fingerprint):
+    """File name (without suffix) of an externalized figure."""
+    return f"{name}-{fingerprint}"
+
+
+def find_figures(texfiles):
+    """File names of the externalized figures used in the given (generated) TeX files."""
+    found = set()
+    for texfile in texfiles:
+        with open(texfile, 'r') as f:
+            found.update(_next_filename.findall(f.read()))
+    return found
+
+
+def prune(directory, current):
+    """Delete outdated versions of the externalized figures `current` from `directory`.
+
+    `current` are the file names (name and fingerprint) of figures, e.g.,
+    from find_figures(). Only files that look like externalized annex
+    figures (name, dash, fingerprint, suffix of the external library)
+    with the name of one of these figures, but another fingerprint, are
+    deleted; the figures of other output files are kept. Returns the list
+    of deleted files.
+    """
+    names = set()
+    for stem in current:
+        match = _externalized_file.match(stem)
+        if match:
+            names.add(match.group(1))
+    deleted = []
+    for filename in sorted(os.listdir(directory)):
+        stem, suffix = os.path.splitext(filename)
+        match = _externalized_file.match(stem)
+        if suffix not in EXTERNAL_SUFFIXES or not match:
+            continue
+        if stem in current or match.group(1) not in names:
+            continue
+        os.remove(os.path.join(directory, filename))
+        deleted.append(filename)
+    return deleted
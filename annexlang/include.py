@@ -0,0 +1,158 @@
+import os
+import re
+import hashlib
+from contextvars import ContextVar
+from copy import deepcopy
+
+from yaml.constructor import ConstructorError
+
+from .components import ProtocolStep, Party, object_numbering
+from .loader import load, add_constructor
+
+# Fragments loaded in this process, keyed by the absolute path of the file
+_fragments = {}
+# Fragment files have a top-level key 'fragment' (diagrams have 'protocol')
+_fragment_key = re.compile(r'^fragment\s*:', re.M)
+# Fragments being loaded (to detect fragments including themselves)
+_loading = ContextVar('annex_fragments_loading', default=())
+
+
+def file_digest(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def dependencies_fresh(dependencies):
+    """Whether the files in `dependencies` (path -> digest) are unchanged."""
+    for filename, digest in dependencies.items():
+        try:
+            if file_digest(filename) != digest:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def is_fragment_file(filename):
+    """Whether `filename` is a fragment file (see Fragment) rather than a diagram."""
+    try:
+        with open(filename, 'r') as f:
+            return _fragment_key.search(f.read()) is not None
+    except (OSError, UnicodeDecodeError):
+        return False
+
+
+class Fragment:
+    """A step (usually a Serial or Parallel) from a fragment file, to be included in protocols.
+
+    A fragment file contains the parties used by the fragment, by name,
+    and the step:
+
+        parties:
+          browser: &browser !Party {name: Browser}
+          idp: &idp !Party {name: IdP}
+        fragment:
+          !Serial
+          steps:
+            - !msg {src: *browser, dest: *idp, caption: login}
+
+    Protocols include it with
+
+        - !include
+          file: login.yml  # relative to the including file
+          parties: {browser: *b, idp: *i}
+
+    which binds the parties of the fragment to parties of the protocol.
+    Each !include gets its own copy of the steps; their ids are prefixed
+    with the name given as `as:` or else with the name of the file and
+    the number of the inclusion (e.g., login1-start, login2-start).
+    """
+
+    def __init__(self, filename, digest, parties, step, includes):
+        self.filename = filename
+        self.digest = digest
+        self.parties = parties
+        self.step = step
+        self.includes = includes  # files included by the fragment, path -> digest
+        # the copies get new annexids
+        for obj in step.walk():
+            vars(obj).pop('annexid', None)
+
+    def instantiate(self, parties, scope):
+        """A copy of the step, with `parties` bound and the ids of the steps prefixed with `scope`."""
+        if set(parties) != set(self.parties):
+            raise Exception(f"Fragment {self.filename} needs the parties {sorted(self.parties)}, got {sorted(parties)}")
+        memo = {id(self.parties[name]): party for name, party in parties.items()}
+        step = deepcopy(self.step, memo)
+        # keep the ids unique when a fragment is included more than once
+        for obj in step.walk():
+            if getattr(obj, 'id', False):
+                obj.id = f"{scope}-{obj.id}"
+        return step
+
+
+def load_fragment(filename):
+    """The Fragment in `filename`, parsed only once per process (unless the file changes)."""
+    filename = os.path.abspath(filename)
+    digest = file_digest(filename)
+    fragment = _fragments.get(filename)
+    if fragment is not None and fragment.digest == digest and dependencies_fresh(fragment.includes):
+        return fragment
+    loading = _loading.get()
+    if filename in loading:
+        raise Exception(f"Fragment {filename} includes itself")
+    token = _loading.set(loading + (filename,))
+    try:
+        includes = {}
+        with open(filename, 'r') as f:
+            src = f.read()
+        # fragments are numbered separately, so that loading them does not change the document's annexids
+        with object_numbering():
+            parsed = load(src, os.path.dirname(filename), includes)
+    finally:
+        _loading.reset(token)
+    if not isinstance(parsed, dict) or not isinstance(parsed.get('fragment'), ProtocolStep):
+        raise Exception(f"Fragment {filename} needs a step under 'fragment'")
+    parties = parsed.get('parties') or {}
+    if not isinstance(parties, dict) or not all(isinstance(p, Party) for p in parties.values()):
+        raise Exception(f"Fragment {filename} needs a mapping of names to parties under 'parties'")
+    declared = {id(party) for party in parties.values()}
+    for step in parsed['fragment'].walk():
+        for value in vars(step).values():
+            for party in (value if isinstance(value, list) else [value]):
+                if isinstance(party, Party) and id(party) not in declared:
+                    raise Exception(f"Fragment {filename} uses the party '{getattr(party, 'name', party.annexid)}', "
+                                    f"which is not declared under 'parties'")
+    fragment = _fragments[filename] = Fragment(filename, digest, parties, parsed['fragment'], includes)
+    return fragment
+
+
+def include_scope(loader, fragment, name=None):
+    """The prefix for the ids of an included fragment: `name` (from as:) or,
+    e.g., login2 for the second inclusion of login.yml in the document."""
+    if name:
+        return str(name)
+    if not hasattr(loader, 'include_counts'):
+        loader.include_counts = {}
+    number = loader.include_counts[fragment.filename] = loader.include_counts.get(fragment.filename, 0) + 1
+    return f"{os.path.splitext(os.path.basename(fragment.filename))[0]}{number}"
+
+
+def construct_include(loader, node):
+    args = loader.construct_mapping(node, deep=True)
+    if 'file' not in args:
+        raise ConstructorError(None, None, "!include without file", node.start_mark)
+    try:
+        fragment = load_fragment(os.path.join(getattr(loader, 'directory', None) or '', str(args['file'])))
+        step = fragment.instantiate(args.get('parties') or {}, include_scope(loader, fragment, args.get('as')))
+    except Exception as e:
+        # report the error at the !include
+        raise ConstructorError(None, None, f"cannot include {args['file']}: {e}", node.start_mark)
+    includes = getattr(loader, 'includes', None)
+    if includes is not None:
+        includes.update(fragment.includes)
+        includes[fragment.filename] = fragment.digest
+    return step
+
+
+add_constructor('!include', construct_include)
@@ -15,10 +15,8 @@ class GenericMessage(ProtocolStep):
         if hasattr(self, 'reply_to'):
             self.dest = self.reply_to.src
             self.src = self.reply_to.dest
-        self._affecting_nodes = [
-            self.get_pos(self.src.column, self.line),
-            self.get_pos(self.dest.column, self.line)
-        ]
+        self.add_affecting_node(self.get_pos(self.src.column, self.line))
+        self.add_affecting_node(self.get_pos(self.dest.column, self.line))
 
     @property
     def affected_parties(self):
@@ -32,6 +30,14 @@ class GenericMessage(ProtocolStep):
             \draw[annex_{self.type}{self.tikz_extra_style}] ({src}) to {self.tikz_above} {self.tikz_below} ({dest}); """
         return out
 
+    def svg(self, svg):
+        svg.message(self, self.src.column, self.dest.column, self.type)
+
+    def svg_markers(self, svg):
+        x1, y = svg.pos(self.src.column, self.line)
+        x2, _ = svg.pos(self.dest.column, self.line)
+        svg.notes(self, min(x1, x2), max(x1, x2), y)
+
     def tikz_notes(self):
         out = ""
         src = self.get_pos(self.src.column, self.line)
@@ -132,6 +138,10 @@ class HTTPRequestResponse(HTTPRequest):
         \draw[annex_{self.type_above},transform canvas={{yshift=0.25ex}}{self.tikz_extra_style}] ({src}) to {self.tikz_above} ({dest});
         \draw[annex_{self.type_below},transform canvas={{yshift=-0.25ex}}{self.tikz_extra_style}] ({dest}) to {self.tikz_below} ({src});"""
 
+    def svg(self, svg):
+        svg.message(self, self.src.column, self.dest.column, self.type_above, below=[], shift='0.25ex')
+        svg.message(self, self.dest.column, self.src.column, self.type_below, above=[], shift='-0.25ex')
+
 
 class XHRRequestResponse(HTTPRequestResponse):
     yaml_tag = '!xhr-request-response'
@@ -153,6 +163,10 @@ class HTTPResponseRequest(HTTPRequest):
         \draw[annex_{self.type_above},transform canvas={{yshift=0.25ex}}{self.tikz_extra_style}] ({dest}) to {self.tikz_above} ({src});
         \draw[annex_{self.type_below},transform canvas={{yshift=-0.25ex}}{self.tikz_extra_style}] ({src}) to {self.tikz_below} ({dest});"""
 
+    def svg(self, svg):
+        svg.message(self, self.dest.column, self.src.column, self.type_above, below=[], shift='0.25ex')
+        svg.message(self, self.src.column, self.dest.column, self.type_below, above=[], shift='-0.25ex')
+
     
 class XHRResponseRequest(HTTPResponseRequest):
     yaml_tag = '!xhr-request-response'
@@ -172,10 +186,8 @@ class PostMessage(ProtocolStep):
         super()._init(*args, **kwargs)
         self.text_above = str(self.body)
         self.text_below = str(self.comment)
-        self._affecting_nodes = [
-            self.get_pos(self.src.column, self.line),
-            self.get_pos(self.dest.column, self.line)
-        ]
+        self.add_affecting_node(self.get_pos(self.src.column, self.line))
+        self.add_affecting_node(self.get_pos(self.dest.column, self.line))
 
     @property
     def affected_parties(self):
@@ -188,6 +200,9 @@ class PostMessage(ProtocolStep):
         return fr"""%% draw postmessage
         \draw[annex_postmessage{self.tikz_extra_style}] ({src}) to {self.tikz_above} {self.tikz_below} ({dest});"""
 
+    def svg(self, svg):
+        svg.message(self, self.src.column, self.dest.column, 'postmessage')
+
 #    def height(self):
 #        if self.tikz_above:
 #            return "4ex", "south,yshift=-1ex"
@@ -195,11 +210,14 @@ class PostMessage(ProtocolStep):
 #            return "1ex", "center"
     @property
     def height(self):
-        if self.tikz_above and self.tikz_below:
+        # like checking tikz_above and tikz_below, without creating their nodes
+        above = self.text_above or (self.id_above and self.tex_id)
+        below = self.text_below
+        if above and below:
             return "4ex" + ("+2ex" * len(self.lines_below)), "north,yshift=3ex"
-        elif self.tikz_above:
+        elif above:
             return "4ex", "south,yshift=-1ex"
-        elif self.tikz_below:
+        elif below:
             return "2ex" + ("+2ex" * len(self.lines_below)), "north,yshift=1ex"
         else:
             return "1ex", "center"
@@ -216,10 +234,19 @@ class Action(ProtocolStep):
         pos = self.get_pos(self.party.column, self.line)
         text = self.tex_id + self.contour(str(self.label))
         tex_label = self.id.replace("_", r"\_") if getattr(self, 'id', False) else ''
-        out = fr"""\node[annex_action,name={self.node_name}{self.tikz_extra_style},"""
-        out += fr"""pin={{[pin distance=-6pt,pin edge={{draw=none}},annex_debug]90:{{{tex_label}}} }}] at ({pos}) {{{text}}};"""
+        pin = self.debug_pin(fr"""[pin distance=-6pt,pin edge={{draw=none}},annex_debug]90:{{{tex_label}}} """)
+        out = fr"""\node[annex_action,name={self.node_name}{self.tikz_extra_style}{pin}] at ({pos}) {{{text}}};"""
         return out
 
+    def svg(self, svg):
+        x, y = svg.pos(self.party.column, self.line)
+        svg.box(x, y, str(getattr(self, 'label', '')), svg.css('annex_action', self.style), number=svg.step_number(self),
+                rounded=0, parties=self.affected_parties)
+
+    def svg_markers(self, svg):
+        box = svg.step_box(self)
+        svg.notes(self, box.x1, box.x2, (box.y1 + box.y2) / 2)
+
     def tikz_notes(self):
         out = ""
         if hasattr(self, 'note_right'):
@@ -249,16 +276,26 @@ class ScriptAction(Action):
     def _init(self, *args, **kwargs):
         self.party = self.src
         super()._init(*args, **kwargs)
+
+    def layout(self):
+        self.text_above = str(self.data)
+        super().layout()
     
     def tikz_arrows(self):
         direction = "east" if self.src.column < self.dest.column else "west"
         src = self.get_pos(self.src.column, self.line)
         dest = self.get_pos(self.dest.column, self.line)
-        self.text_above = str(self.data)
         rev = "_reversed" if getattr(self, 'reversed', False) else ''
         return fr"""%% draw script action arrow
         \draw[annex_script_action_arrow{rev}{self.tikz_extra_style}] ({self.node_name}.{direction}) to  {self.tikz_above} ({dest});"""
 
+    def svg(self, svg):
+        super().svg(svg)
+        box = svg.step_box(self)
+        x, _ = svg.pos(self.dest.column, self.line)
+        rev = "_reversed" if getattr(self, 'reversed', False) else ''
+        svg.arrow(self, box.x2 if self.src.column < self.dest.column else box.x1, x, f'script_action_arrow{rev}', below=[])
+
     @property
     def height(self):
         return "4ex", "center"
@@ -292,6 +329,16 @@ class EndParty(ProtocolStep):
         out += fr"""\node[name={self.node_name},annex_{self.type}_box,{self.party.style}] at ({pos}) {{{text}}};"""
         return out
 
+    def svg(self, svg):
+        x, y = svg.pos(self.party.column, self.line)
+        css = svg.css(f'annex_{self.type}_box', self.party.style)
+        scale = 0.7 if self.endsparty else 1  # see annex_end_party_box
+        if getattr(self.party, "multiple", False):
+            for c in reversed(range(1, 3)):
+                shift = svg.length(f"{c*.5}mm", 0)
+                svg.box(x + shift, y - shift, self.party.name, css, scale=scale, parties=self.affected_parties)
+        svg.box(x, y, self.party.name, css, scale=scale, parties=self.affected_parties)
+
     @property
     def height(self):
         return "5ex", "center"
@@ -303,11 +350,14 @@ class StartParty(EndParty):
     type = 'start_party'
     endsparty = False
     startsparty = True
-    lifeline_segments = []
+    lifeline_segments = ()
 
     def tikz_arrows(self):
+        return self.tikz_lifeline(self.protocol.visible_segments(self.lifeline_segments))
+
+    def tikz_lifeline(self, segments):
         out = ""
-        for segment in self.lifeline_segments:
+        for segment in segments:
             if segment[0] % 2 == 1:
                 node_above = self.get_pos(self.party.column, segment[0] // 2)
                 node_below = self.get_pos(self.party.column, segment[0] // 2 + 1)
@@ -325,6 +375,12 @@ class StartParty(EndParty):
             out += fr"""\draw[{segment[2]}] ({src}) -- ({dest});"""
         return out
 
+    def svg(self, svg):
+        super().svg(svg)
+        x, _ = svg.pos(self.party.column, self.line)
+        for start, end, style in self.lifeline_segments:
+            svg.line(x, svg.half_line_y(start), x, svg.half_line_y(end), svg.css(style), track=False)
+
 
 class DummyParty(ProtocolStep):
     yaml_tag = '!dummy-party'
@@ -354,15 +410,24 @@ class OpenWindowStartParty(StartParty):
     def _init(self, *args, **kwargs):
         super()._init(*args, **kwargs)
         self.party = self.dest
+
+    def layout(self):
+        self.text_above = "open"
+        super().layout()
     
     def tikz_arrows(self):
         direction = "east" if self.src.column > self.dest.column else "west"
         src = self.get_pos(self.src.column, self.line)
-        self.text_above = "open"
         out = fr"""%% draw open window arrow
         \draw[annex_open_window_start_party_arrow{self.tikz_extra_style}] ({src}) to  {self.tikz_above} ({self.node_name}.{direction});"""
         out += super().tikz_arrows()
         return out
+
+    def svg(self, svg):
+        super().svg(svg)
+        box = svg.step_box(self)
+        x, _ = svg.pos(self.src.column, self.line)
+        svg.arrow(self, x, box.x2 if self.src.column > self.dest.column else box.x1, 'open_window_start_party_arrow', below=[])
     
     @property
     def height(self):
@@ -382,15 +447,24 @@ class CloseWindowEndParty(EndParty):
     def _init(self, *args, **kwargs):
         super()._init(*args, **kwargs)
         self.party = self.dest
+
+    def layout(self):
+        self.text_above = "close"
+        super().layout()
     
     def tikz_arrows(self):
         direction = "east" if self.src.column > self.dest.column else "west"
         src = self.get_pos(self.src.column, self.line)
-        self.text_above = "close"
         out = fr"""%% draw close window arrow
         \draw[annex_close_window_end_party_arrow{self.tikz_extra_style}] ({src}) to  {self.tikz_above} ({self.node_name}.{direction});"""
         out += super().tikz_arrows()
         return out
+
+    def svg(self, svg):
+        super().svg(svg)
+        box = svg.step_box(self)
+        x, _ = svg.pos(self.src.column, self.line)
+        svg.arrow(self, x, box.x2 if self.src.column > self.dest.column else box.x1, 'close_window_end_party_arrow', below=[])
     
     @property
     def height(self):
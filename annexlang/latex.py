@@ -0,0 +1,163 @@
+import os
+import hashlib
+import shutil
+import subprocess
+import tempfile
+
+from . import __version__
+from .cache import CACHE_DIR
+
+ENGINES = ('pdflatex', 'lualatex')
+DEFAULT_ENGINE = 'pdflatex'
+
+# Everything the generated TikZ code needs (see docs/examples/demo.tex).
+# The preamble is dumped into a format file once; figures are compiled
+# against that format, which saves loading TikZ, fontawesome and contour
+# for every figure.
+PREAMBLE = r"""\documentclass[border=1pt]{standalone}
+\usepackage{fontawesome}
+\usepackage{tikz}
+\usepackage{url}
+\usetikzlibrary{fit,positioning,arrows.meta,decorations.pathreplacing,calc}
+\usepackage[outline]{contour}
+
+\newcounter{protostep}
+\renewcommand{\theprotostep}{\arabic{protostep}}
+\def\protostep#1{\resizebox{!}{0.8\baselineskip}{\begin{tikzpicture}[baseline={([yshift=-0.5pt]O.base)}] \node (O) [sharp corners,fill=blue,inner sep=1ex]{\color{white}\textbf{\refstepcounter{protostep}\theprotostep\label{protostep:#1}}};\end{tikzpicture}}}
+\def\refprotostep#1{\resizebox{!}{0.6\baselineskip}{\begin{tikzpicture}[baseline={([yshift=-1.5pt]O.base)}] \node (O) [draw,sharp corners]{\ref{protostep:#1}};\end{tikzpicture}}}
+"""
+
+
+# If TeX reports "TeX capacity exceeded", the compilation is retried with
+# larger memory settings (texmf.cnf variables, which can be overridden in
+# the environment): attempt n uses these values times 2 ** (n - 1).
+CAPACITY_SETTINGS = {
+    'extra_mem_top': 2500000,
+    'extra_mem_bot': 2500000,
+    'pool_size': 5000000,
+    'save_size': 100000,
+    'stack_size': 10000,
+    'buf_size': 500000,
+    'param_size': 10000,
+    'nest_size': 1000,
+}
+CAPACITY_RETRIES = 2
+
+
+def preamble(extra=''):
+    return PREAMBLE + extra
+
+
+def format_name(engine, preamble):
+    """Name of the format file for a preamble; changes whenever the preamble (or engine) does."""
+    h = hashlib.sha256()
+    for part in (__version__, engine, preamble):
+        h.update(part.encode())
+        h.update(b'\0')
+    return f"annex-{engine}-{h.hexdigest()[:16]}"
+
+
+def run(command, cwd, env=None, timeout=None, memory_limit=None):
+    """Run TeX and return (success, output).
+
+    `timeout` is in seconds, `memory_limit` (of the address space) in
+    bytes; a TeX run exceeding either is stopped.
+    """
+    if shutil.which(command[0]) is None:
+        raise Exception(f"{command[0]} not found, please install a TeX distribution (or choose another engine)")
+
+    def limit_memory():
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+    try:
+        result = subprocess.run(command, cwd=cwd, env=env, timeout=timeout,
+                                preexec_fn=limit_memory if memory_limit else None,
+                                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except subprocess.TimeoutExpired:
+        raise Exception(f"{' '.join(command)} did not finish within {timeout} seconds")
+    return result.returncode == 0, result.stdout.decode(errors='replace')
+
+
+def failed(command, output):
+    log = output.strip().splitlines()
+    return Exception(f"{' '.join(command)} failed:\n" + '\n'.join(log[-20:]))
+
+
+def capacity_env(env, attempt):
+    env = dict(env)
+    if attempt:
+        for name, value in CAPACITY_SETTINGS.items():
+            env[name] = str(value * 2 ** (attempt - 1))
+    return env
+
+
+def move_atomic(src, dest):
+    # src may be on another file system (e.g., /tmp), so os.replace() alone does not do
+    tmpname = f"{dest}.{os.getpid()}.tmp"
+    shutil.move(src, tmpname)
+    os.replace(tmpname, dest)
+
+
+def format_directory(pdffile, directory=None):
+    """Where to keep the format files: `directory` or __annexcache__ next to `pdffile`."""
+    if directory is not None:
+        return directory
+    return os.path.join(os.path.dirname(os.path.abspath(pdffile)), CACHE_DIR)
+
+
+def build_format(engine, preamble, format_dir, timeout=None, memory_limit=None):
+    """Dump `preamble` into a format file in `format_dir`, unless it is there already.
+
+    Uses the mylatexformat package: the format contains everything up
+    to \\endofdump. Returns the name of the format.
+    """
+    name = format_name(engine, preamble)
+    fmtfile = os.path.join(format_dir, name + '.fmt')
+    if os.path.exists(fmtfile):
+        return name
+    os.makedirs(format_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix='annex-fmt-') as tmpdir:
+        with open(os.path.join(tmpdir, name + '.tex'), 'w') as f:
+            f.write(preamble + '\\endofdump\n')
+        command = [engine, '-ini', '-interaction=nonstopmode', '-halt-on-error', f'-jobname={name}',
+                   f'&{engine}', 'mylatexformat.ltx', name + '.tex']
+        success, output = run(command, tmpdir, timeout=timeout, memory_limit=memory_limit)
+        if not success:
+            raise failed(command, output)
+        # several processes may build the same format at the same time
+        move_atomic(os.path.join(tmpdir, name + '.fmt'), fmtfile)
+    return name
+
+
+def compile_pdf(tikz, pdffile, engine=DEFAULT_ENGINE, format_dir=None, extra_preamble='',
+                timeout=None, memory_limit=None):
+    """Compile TikZ code (as generated by TikzPicture) to a cropped, standalone PDF.
+
+    The format file is kept in `format_dir` (default: __annexcache__
+    next to `pdffile`) and built on first use. Each TeX run gets its own
+    temporary directory, so many figures can be compiled in parallel.
+    `timeout` and `memory_limit` apply to each TeX run (see run()).
+    Returns the number of retries after "TeX capacity exceeded".
+    """
+    if engine not in ENGINES:
+        raise Exception(f"unknown TeX engine '{engine}', must be one of: {', '.join(ENGINES)}")
+    format_dir = format_directory(pdffile, format_dir)
+    text = preamble(extra_preamble)
+    name = build_format(engine, text, format_dir, timeout, memory_limit)
+
+    env = dict(os.environ)
+    # a trailing separator keeps the default search path
+    env['TEXFORMATS'] = os.path.abspath(format_dir) + os.pathsep + env.get('TEXFORMATS', '')
+    command = [engine, f'-fmt={name}', '-interaction=nonstopmode', '-halt-on-error', 'figure.tex']
+    for attempt in range(CAPACITY_RETRIES + 1):
+        with tempfile.TemporaryDirectory(prefix='annex-pdf-') as tmpdir:
+            with open(os.path.join(tmpdir, 'figure.tex'), 'w') as f:
+                # with the format, everything up to \endofdump is skipped
+                f.write(text + '\\endofdump\n\\begin{document}\n' + tikz + '\n\\end{document}\n')
+            success, output = run(command, tmpdir, capacity_env(env, attempt), timeout, memory_limit)
+            if success:
+                move_atomic(os.path.join(tmpdir, 'figure.pdf'), pdffile)
+                return attempt
+        if 'TeX capacity exceeded' not in output or attempt == CAPACITY_RETRIES:
+            raise failed(command, output)
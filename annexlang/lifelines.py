@@ -0,0 +1,106 @@
+from bisect import bisect_right
+
+DEFAULT_LIFELINE_STYLE = "annex_lifeline"
+
+
+def _paint(num_lines, blocks):
+    """Return, for each line, the style of the last block covering it (or None).
+
+    `blocks` is a list of (first_line, last_line, style). Later blocks
+    win, so we assign the blocks in reverse order and never touch a
+    line twice: `next_free` is a union-find structure that points to
+    the next line which has not been assigned yet.
+    """
+    styles = [None] * num_lines
+    next_free = list(range(num_lines + 1))
+
+    def find(i):
+        root = i
+        while next_free[root] != root:
+            root = next_free[root]
+        while next_free[i] != root:
+            next_free[i], i = root, next_free[i]
+        return root
+
+    for first, last, style in reversed(blocks):
+        i = find(max(first, 0))
+        last = min(last, num_lines - 1)
+        while i <= last:
+            styles[i] = style
+            next_free[i] = i + 1
+            i = find(i + 1)
+    return styles
+
+
+def clip_segments(segments, first, last):
+    """The parts of lifeline segments between the half-lines `first` and `last`."""
+    clipped = []
+    for start, end, style in segments:
+        if start == end:
+            if first <= start <= last:
+                clipped.append((start, end, style))
+        elif max(start, first) < min(end, last):
+            clipped.append((max(start, first), min(end, last), style))
+    return clipped
+
+
+class LifelineStyles:
+    """Styles of lifelines as defined by the `lifeline_style` of Serial blocks.
+
+    A block styles the lifeline between the half-lines before and after
+    the block; if several blocks cover the same line, the last one (in
+    protocol order, i.e., the innermost one for nested blocks) wins. A
+    block that only touches the start or the end of a lifeline does not
+    affect it.
+
+    All blocks are processed once, in O(lines + blocks); afterwards, the
+    segments of each lifeline are computed in O(log(lines) + segments).
+    """
+
+    def __init__(self, blocks, num_lines):
+        self.styles_start = _paint(num_lines, [(first, last - 1, style) for first, last, style in blocks])
+        self.styles_end = _paint(num_lines, [(first + 1, last, style) for first, last, style in blocks])
+        # run-length encoding of the style in each line
+        self.run_starts = []
+        self.run_styles = []
+        for line, style in enumerate(_paint(num_lines, blocks)):
+            if not self.run_starts or self.run_styles[-1] != style:
+                self.run_starts.append(line)
+                self.run_styles.append(style)
+        self.num_lines = num_lines
+
+    def segments(self, first_line, last_line):
+        """Segments (start, end, style) of a lifeline from `first_line` to `last_line`.
+
+        Start and end are given in half-lines, i.e., 2 * line or
+        2 * line + 1 for the point between two lines.
+        """
+        if first_line == last_line:
+            style = self.styles_start[first_line] or DEFAULT_LIFELINE_STYLE
+            return [(first_line * 2, last_line * 2, style)]
+
+        pieces = []
+
+        def add(first, last, style):
+            if first > last:
+                return
+            style = style or DEFAULT_LIFELINE_STYLE
+            if pieces and pieces[-1][2] == style:
+                pieces[-1][1] = last
+            else:
+                pieces.append([first, last, style])
+
+        add(first_line, first_line, self.styles_start[first_line])
+        run = bisect_right(self.run_starts, first_line + 1) - 1
+        while run < len(self.run_starts) and self.run_starts[run] < last_line:
+            run_end = self.run_starts[run + 1] - 1 if run + 1 < len(self.run_starts) else self.num_lines - 1
+            add(max(self.run_starts[run], first_line + 1), min(run_end, last_line - 1), self.run_styles[run])
+            run += 1
+        add(last_line, last_line, self.styles_end[last_line])
+
+        segments = []
+        for i, (first, last, style) in enumerate(pieces):
+            start = first_line * 2 if i == 0 else first * 2 - 1
+            end = last_line * 2 if i == len(pieces) - 1 else last * 2 + 1
+            segments.append((start, end, style))
+        return segments
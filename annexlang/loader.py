@@ -0,0 +1,103 @@
+import yaml
+
+try:
+    from yaml import CLoader as _BaseLoader
+    LIBYAML = True
+except ImportError:  # PyYAML was built without libyaml
+    from yaml import Loader as _BaseLoader
+    LIBYAML = False
+
+
+class AnnexLoader(_BaseLoader):
+    """YAML loader for annex files.
+
+    Uses the libyaml parser if available and falls back to the pure
+    Python parser otherwise. The annex tags are registered on this
+    loader explicitly: all protocol objects and styles (including the
+    ones from annex_custom.py and plugins) list it in their
+    `yaml_loader`.
+    """
+
+
+def yaml_loaders():
+    """Loaders on which annex classes register their YAML tags."""
+    loaders = yaml.YAMLObject.yaml_loader
+    if not isinstance(loaders, list):  # PyYAML < 5.1
+        loaders = [loaders]
+    return loaders + [AnnexLoader]
+
+
+def add_constructor(tag, constructor):
+    for loader in yaml_loaders():
+        loader.add_constructor(tag, constructor)
+
+
+def add_implicit_resolver(tag, regexp, first):
+    for loader in yaml_loaders():
+        loader.add_implicit_resolver(tag, regexp, first)
+
+
+# Entry point group of plugins: packages providing more step or style
+# classes. Each entry point is named after a YAML tag (with or without
+# the leading !) and refers to the class for the tag or to a module
+# which defines it, e.g., in setup.py:
+#     entry_points={'annexlang.tags': ['my-step = mypackage.steps:MyStep']}
+PLUGIN_GROUP = 'annexlang.tags'
+
+_plugins = None
+
+
+def _entry_points(group):
+    from importlib.metadata import entry_points
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        return eps.select(group=group)
+    return eps.get(group, [])  # Python 3.9
+
+
+def plugins():
+    """Entry points of the installed plugins, keyed by YAML tag."""
+    global _plugins
+    if _plugins is None:
+        found = {}
+        for entry_point in _entry_points(PLUGIN_GROUP):
+            tag = entry_point.name if entry_point.name.startswith('!') else '!' + entry_point.name
+            found.setdefault(tag, entry_point)
+        _plugins = found
+    return _plugins
+
+
+def construct_plugin(loader, node):
+    """Constructor for tags without a registered class.
+
+    Looks for a plugin for the tag and imports it, which registers the
+    class for the tag. So the plugins are only discovered when a
+    document uses an unknown tag, and each plugin is only imported when
+    its tag first appears (once per process).
+    """
+    entry_point = plugins().get(node.tag)
+    if entry_point is None:
+        return loader.construct_undefined(node)
+    entry_point.load()
+    constructor = type(loader).yaml_constructors.get(node.tag)
+    if constructor is None:
+        raise Exception(f"Plugin {entry_point.value} does not define a class for the tag {node.tag}")
+    return constructor(loader, node)
+
+
+AnnexLoader.add_constructor(None, construct_plugin)
+
+
+def load(src, directory=None, includes=None):
+    """Parse annex source code.
+
+    Files included with !include are relative to `directory`; their
+    digests are added to the dict `includes` (path -> digest), if given.
+    """
+    loader = AnnexLoader(src)
+    loader.directory = directory
+    loader.includes = includes
+    try:
+        return loader.get_single_data()
+    finally:
+        loader.dispose()
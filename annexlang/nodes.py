@@ -0,0 +1,68 @@
+from array import array
+
+
+class NodeRegistry:
+    """All TikZ nodes that determine the extent of steps and parties.
+
+    Nodes are used to fit boxes around condensed steps and groups. Each
+    node is stored once, together with the (pre-order) index of the step
+    it belongs to; parties only keep the indices of their nodes. The
+    nodes of each step form a linked list, so adding a node takes
+    constant time, also while the layers are rendered (nodes are
+    created lazily, interleaved with lookups). Since the steps of a
+    subtree have consecutive indices, the nodes of a step or a subtree
+    can be looked up in time proportional to the number of steps and
+    nodes found.
+    """
+
+    def __init__(self, num_steps):
+        self.num_steps = num_steps
+        self.names = []
+        self.owners = array('l')
+        self._party_nodes = {}
+        # _first[i] and _last[i] are the first and last node of step i, _next[node]
+        # the node of the same step added after node (-1 for none)
+        self._first = array('l', [-1]) * num_steps
+        self._last = array('l', [-1]) * num_steps
+        self._next = array('l')
+
+    def __repr__(self):
+        return f"""<NodeRegistry with {len(self.names)} nodes>"""
+
+    def add(self, step_index, name, parties=()):
+        node = len(self.names)
+        self.names.append(name)
+        self.owners.append(step_index)
+        self._next.append(-1)
+        last = self._last[step_index]
+        if last == -1:
+            self._first[step_index] = node
+        else:
+            self._next[last] = node
+        self._last[step_index] = node
+        for party in parties:
+            if party not in self._party_nodes:
+                self._party_nodes[party] = array('l')
+            self._party_nodes[party].append(node)
+        return name
+
+    def step_nodes(self, first, end=None):
+        """Names of the nodes of the steps with indices first, ..., end - 1."""
+        if end is None:
+            end = first + 1
+        names = self.names
+        next_node = self._next
+        out = []
+        for node in self._first[first:end]:
+            while node != -1:
+                out.append(names[node])
+                node = next_node[node]
+        return out
+
+    def party_nodes(self, party, first=None, end=None):
+        """Names of the nodes of a party, optionally only those of the steps first, ..., end - 1."""
+        names = self.names
+        if first is None:
+            return [names[node] for node in self._party_nodes.get(party, ())]
+        owners = self.owners
+        return [names[node] for node in self._party_nodes.get(party, ()) if first <= owners[node] < end]
@@ -0,0 +1,145 @@
+from .components import MultiStep, Serial, Separator
+
+# Height of the row with the party boxes at the top of a continued page
+# (like StartParty.height)
+HEADER_HEIGHT = ("5ex", "center")
+
+# Rough cost of the header of a continued page, per column
+HEADER_COST = 2
+
+
+def num_lines(step):
+    # MultiSteps store their length, other steps have length() == 1
+    return step.length if isinstance(step, MultiStep) else step.length()
+
+
+def step_cost(step):
+    """Rough number of TikZ nodes and paths drawn for a step (without its sub-steps)."""
+    # avoid computing the height, which creates nodes for some steps
+    cost = 1 if hasattr(type(step), 'height') else 0
+    if isinstance(step, MultiStep):
+        if step.condense or hasattr(step, 'label'):
+            cost += 2
+        return cost
+    cost += 1 + len(step.lines_above) + len(step.lines_below)
+    cost += len(getattr(step, 'lifeline_segments', ()))
+    return cost
+
+
+def top_level_cost(step, num_columns):
+    """Cost of a top-level step: all steps within it and its rows in the matrix."""
+    steps = step.protocol.table.walk(step._index, step._index_end)
+    return sum(step_cost(s) for s in steps) + num_lines(step) * num_columns
+
+
+def page_units(step, budget, num_columns):
+    """The parts of a top-level step that pages can be cut between, as (step, cost) tuples.
+
+    A step exceeding the budget is split into its sub-steps (again
+    recursively) if it is a Serial without a box around it (see
+    MultiStep.tikz_markers(), the box could not be drawn across pages).
+    The steps of a Parallel share their lines, so it is never split.
+    """
+    cost = top_level_cost(step, num_columns)
+    if cost > budget and type(step) is Serial and step.steps and not (step.condense or hasattr(step, 'label')):
+        for sub_step in step.steps:
+            yield from page_units(sub_step, budget, num_columns)
+    else:
+        yield step, cost
+
+
+class Page:
+    """A run of consecutive steps, rendered as one tikzpicture.
+
+    The steps are top-level steps or parts of a top-level step (see
+    page_units()). Since the steps of a subtree are numbered
+    consecutively, the steps (and their nodes) on a page have the
+    indices first_index, ...,
+    end_index - 1. Lifelines of parties that were started on an earlier
+    page are carried over: a box with the party name is repeated at the
+    top of the page (in the line before the first line of the page) and
+    the lifeline continues from there.
+    """
+
+    def __init__(self, protocol, steps, number):
+        self.protocol = protocol
+        self.steps = steps
+        self.number = number
+        self.continued = number > 1
+        self.first_line = steps[0].line if self.continued else 0
+        self.end_line = steps[-1].line + num_lines(steps[-1])
+        self.first_index = steps[0]._index
+        self.end_index = steps[-1]._index_end
+        self.header_line = self.first_line - 1
+        self.carried = [
+            start for start in protocol.lifelines
+            if start.line < self.first_line <= start.end.line
+        ] if self.continued else []
+
+    def __repr__(self):
+        return f"""<Page {self.number} with lines {self.first_line}-{self.end_line - 1}>"""
+
+    def rows(self, heights):
+        """Lines of the matrix on this page, with the dummy heights of each line."""
+        rows = []
+        if self.continued:
+            if self.protocol.has_groups:
+                rows.append((0, heights[0]))
+            rows.append((self.header_line, [HEADER_HEIGHT]))
+        for line in range(self.first_line, self.end_line):
+            rows.append((line, heights[line]))
+        return rows
+
+    @property
+    def visible_half_lines(self):
+        # lifelines are drawn between these half-lines (see LifelineStyles)
+        first = self.header_line if self.continued else self.first_line
+        return first * 2, (self.end_line - 1) * 2
+
+    def walk(self):
+        return self.protocol.table.walk(self.first_index, self.end_index)
+
+    def party_nodes(self, party):
+        nodes = self.protocol.node_registry.party_nodes(party, self.first_index, self.end_index)
+        if any(start.party is party for start in self.carried):
+            nodes.append(party.continued_node_name)
+        return nodes
+
+
+def paginate(protocol, budget):
+    """Split the steps of a protocol into pages with a cost of at most `budget`.
+
+    The cost of a page is estimated as the number of TikZ nodes and
+    paths on it (see step_cost()). Pages are cut between top-level steps
+    or, if a top-level step exceeds the budget, between its parts (see
+    page_units()). If possible, pages are cut right after a Separator or
+    else between top-level steps, as long as the page is at least half
+    full then.
+    """
+    num_columns = len(protocol.columns)
+    header_cost = HEADER_COST * num_columns
+    pages = []
+    current = []  # (step, cost) on the current page
+    cost = 0
+    separator_cut = None  # position in current after the last Separator
+    top_level_cut = None  # position in current after the last top-level step
+    for top_level_step in protocol.steps:
+        for step, step_total in page_units(top_level_step, budget, num_columns):
+            if current and cost + step_total > budget:
+                cut = len(current)
+                for preferred in (separator_cut, top_level_cut):
+                    if preferred is not None and sum(c for s, c in current[:preferred]) >= budget / 2:
+                        cut = preferred
+                        break
+                pages.append([s for s, c in current[:cut]])
+                current = current[cut:]
+                cost = header_cost + sum(c for s, c in current)
+                separator_cut = top_level_cut = None
+            current.append((step, step_total))
+            cost += step_total
+            if isinstance(step, Separator):
+                separator_cut = len(current)
+        top_level_cut = len(current)
+    if current:
+        pages.append([s for s, c in current])
+    return [Page(protocol, steps, number) for number, steps in enumerate(pages, 1)]
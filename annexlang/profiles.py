@@ -0,0 +1,30 @@
+# Emission profiles control what is written to the TikZ output in addition
+# to the picture itself:
+#  - comments: for each layer, whether each step is preceded by a comment
+#    describing it ('full': all attributes of the step, 'short': type and
+#    matrix line only, None: no comment),
+#  - debug_pins: whether invisible pins with the step ids are attached to
+#    actions and arrow captions (made visible by !style-debug).
+PROFILES = {
+    'production': {
+        'comments': {'main': None, 'arrows': None, 'groups': None, 'markers': None},
+        'debug_pins': False,
+    },
+    'annotated': {
+        'comments': {'main': 'short', 'arrows': None, 'groups': 'short', 'markers': None},
+        'debug_pins': False,
+    },
+    'debug': {
+        'comments': {'main': 'full', 'arrows': 'full', 'groups': 'full', 'markers': 'full'},
+        'debug_pins': True,
+    },
+}
+
+DEFAULT_PROFILE = 'debug'
+
+
+def get_profile(options):
+    name = options.get('profile', DEFAULT_PROFILE)
+    if name not in PROFILES:
+        raise Exception(f"unknown profile '{name}', must be one of: {', '.join(PROFILES)}")
+    return PROFILES[name]
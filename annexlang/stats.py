@@ -0,0 +1,103 @@
+import re
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+_node = re.compile(r'\\node\b')
+_path = re.compile(r'\\(?:draw|path|fill|filldraw|shade)\b')
+
+
+class Stats:
+    """Wall time and allocations of the phases of a conversion, and what it emitted.
+
+    Pass a Stats object to convert(), render() or the picture classes.
+    The phases are loading annex_custom.py, parsing, the phases of
+    Protocol.init() and rendering the matrix and each layer (a phase
+    that runs several times, e.g., once per page, is added up). With
+    `allocations`, the memory allocated in each phase is measured with
+    tracemalloc, which makes the conversion considerably slower.
+
+    `on_start(name)` and `on_end(name, seconds, allocated)` are called
+    around each phase, e.g., to export metrics (allocated is None
+    without `allocations`).
+    """
+
+    def __init__(self, allocations=False, on_start=None, on_end=None):
+        self.allocations = allocations
+        self.on_start = on_start
+        self.on_end = on_end
+        self.phases = {}
+        self.steps = Counter()
+        self.output = {}
+
+    @contextmanager
+    def phase(self, name):
+        if self.on_start is not None:
+            self.on_start(name)
+        started_tracing = False
+        if self.allocations:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            allocated = peak = None
+            if self.allocations:
+                current, peak = tracemalloc.get_traced_memory()
+                allocated, peak = current - before, peak - before
+                if started_tracing:
+                    tracemalloc.stop()
+            record = self.phases.setdefault(name, {'seconds': 0.0, 'calls': 0, 'allocated': None, 'peak': None})
+            record['seconds'] += seconds
+            record['calls'] += 1
+            if allocated is not None:
+                record['allocated'] = (record['allocated'] or 0) + allocated
+                record['peak'] = max(record['peak'] or 0, peak)
+            if self.on_end is not None:
+                self.on_end(name, seconds, allocated)
+
+    def count_steps(self, protocol):
+        self.steps.update(protocol.table.type_counts())
+
+    def emitted(self, name, code):
+        """Count the bytes, TikZ nodes and paths of a part of the output; returns `code`."""
+        record = self.output.setdefault(name, {'bytes': 0, 'nodes': 0, 'paths': 0})
+        record['bytes'] += len(code.encode())
+        record['nodes'] += len(_node.findall(code))
+        record['paths'] += len(_path.findall(code))
+        return code
+
+    def as_dict(self):
+        return {
+            'phases': self.phases,
+            'steps': dict(self.steps.most_common()),
+            'output': self.output,
+        }
+
+    def report(self):
+        """Human-readable summary of the statistics."""
+        def size(value):
+            return '-' if value is None else f"{value / 1024:.1f}K"
+
+        lines = [f"{'phase':<24} {'time':>10} {'calls':>6} {'allocated':>10} {'peak':>10}"]
+        for name, record in self.phases.items():
+            lines.append(f"{name:<24} {record['seconds'] * 1000:>8.1f}ms {record['calls']:>6} "
+                         f"{size(record['allocated']):>10} {size(record['peak']):>10}")
+        lines.append('')
+        lines.append(f"{'steps':<24} {sum(self.steps.values()):>6}")
+        for name, number in self.steps.most_common():
+            lines.append(f"  {name:<22} {number:>6}")
+        if self.output:
+            lines.append('')
+            lines.append(f"{'output':<24} {'bytes':>10} {'nodes':>6} {'paths':>6}")
+            for name, record in self.output.items():
+                lines.append(f"{name:<24} {record['bytes']:>10} {record['nodes']:>6} {record['paths']:>6}")
+            total = {key: sum(record[key] for record in self.output.values()) for key in ('bytes', 'nodes', 'paths')}
+            lines.append(f"{'total':<24} {total['bytes']:>10} {total['nodes']:>6} {total['paths']:>6}")
+        return '\n'.join(lines) + '\n'
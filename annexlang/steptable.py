@@ -0,0 +1,98 @@
+from array import array
+
+# Flags of a step in StepTable.flags
+STARTS_PARTY = 1
+ENDS_PARTY = 2
+DUMMY_PARTY = 4
+HAS_HEIGHT = 8  # has a height or height_overwrite for the matrix
+LIFELINE_STYLE = 16  # sets the style of the lifelines next to it
+
+# attributes the flags depend on; usually class attributes, but can be set per step
+FLAG_ATTRIBUTES = frozenset(('startsparty', 'endsparty', 'dummyparty', 'height', 'height_overwrite', 'lifeline_style'))
+
+
+class StepTable:
+    """An index of the steps of a protocol in pre-order.
+
+    Built once by Protocol.init() after the layout (see init_table()).
+    Entry i is the step with index i, so the steps of a subtree are the
+    entries step._index, ..., step._index_end - 1. Besides the steps,
+    the table only holds their types (as an index into `types`) and
+    flags for what the passes over the protocol need, so that these
+    passes need not probe the attributes of every step. Everything else
+    (lines, texts, ...) is read from the steps themselves.
+    """
+
+    __slots__ = ('steps', 'types', 'kinds', 'flags')
+
+    def __init__(self, protocol):
+        self.steps = steps = []
+        self.types = []
+        kinds, flags = [], []
+        type_kinds = {}
+        class_flags = {}
+        for index, step in enumerate(protocol.walk()):
+            if index != step._index:
+                raise Exception(f"step {step!r} has index {step._index} instead of {index}")
+            cls = type(step)
+            kind = type_kinds.get(cls)
+            if kind is None:
+                kind = type_kinds[cls] = len(self.types)
+                self.types.append(cls)
+            if FLAG_ATTRIBUTES.isdisjoint(vars(step)):
+                step_flags = class_flags.get(cls)
+                if step_flags is None:
+                    step_flags = class_flags[cls] = self.step_flags(step)
+            else:
+                step_flags = self.step_flags(step)
+            steps.append(step)
+            kinds.append(kind)
+            flags.append(step_flags)
+        self.kinds = array('H', kinds)
+        self.flags = array('B', flags)
+
+    @staticmethod
+    def step_flags(step):
+        flags = 0
+        if getattr(step, 'startsparty', False):
+            flags |= STARTS_PARTY
+        if getattr(step, 'endsparty', False):
+            flags |= ENDS_PARTY
+        if getattr(step, 'dummyparty', False):
+            flags |= DUMMY_PARTY
+        # don't compute the height here, which creates nodes for some steps
+        if hasattr(type(step), 'height') or 'height' in vars(step) or hasattr(step, 'height_overwrite'):
+            flags |= HAS_HEIGHT
+        if getattr(step, 'lifeline_style', False):
+            flags |= LIFELINE_STYLE
+        return flags
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __repr__(self):
+        return f"""<StepTable with {len(self.steps)} steps>"""
+
+    def walk(self, first=0, end=None):
+        """The steps with indices first, ..., end - 1 (e.g., a subtree), in pre-order."""
+        if end is None:
+            end = len(self.steps)
+        return iter(self.steps[first:end])
+
+    def with_flag(self, flag, first=0, end=None):
+        """The steps in first, ..., end - 1 with the given flag."""
+        flags = self.flags
+        steps = self.steps
+        if end is None:
+            end = len(steps)
+        return [steps[i] for i in range(first, end) if flags[i] & flag]
+
+    def type_counts(self):
+        """Number of steps of each type (by class name), in the order of their first occurrence."""
+        counts = [0] * len(self.types)
+        for kind in self.kinds:
+            counts[kind] += 1
+        out = {}
+        for cls, number in zip(self.types, counts):
+            out[cls.__name__] = out.get(cls.__name__, 0) + number
+        return out
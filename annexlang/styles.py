@@ -1,24 +1,99 @@
 import yaml
 import re
+import hashlib
+from functools import lru_cache
+
+from .loader import yaml_loaders
+
+STYLE_SHEET_PREFIX = 'annexstyles'
+_annex_style = re.compile(r'annex_[\w ]*/\.(append )?style\s*=')
+
+
+@lru_cache(maxsize=None)
+def resolve_style(tag, style, placeholders):
+    """Replace the placeholders (tuple of (name, replacement)) in a style.
+
+    Memoized, since most figures use the same styles.
+    """
+    placeholders = dict(placeholders)
+    # Check for missing replacements (to avoid confusing TeX errors)
+    for occurence in re.finditer(r'{\|([^|]*)\|}', style):
+        placeholder = occurence.groups()[0]
+        if placeholder not in placeholders:
+            raise Exception(f"undefined placeholder '{placeholder}' for {tag}")
+    for placeholder, replacement in placeholders.items():
+        style = style.replace(f'{{|{placeholder}|}}', replacement)
+    return style.strip().strip(',')
+
+
+def style_sheet_name(style_string):
+    """Name of the TikZ style containing all styles of a figure; changes with the styles."""
+    return f"{STYLE_SHEET_PREFIX}-{hashlib.sha256(style_string.encode()).hexdigest()[:16]}"
+
+
+def split_styles(style_string):
+    """Split a style string into its top-level options, dropping TeX comments."""
+    options = []
+    current = ''
+    depth = 0
+    i = 0
+    while i < len(style_string):
+        c = style_string[i]
+        if c == '\\':
+            current += style_string[i:i + 2]
+            i += 2
+            continue
+        if c == '%':
+            end = style_string.find('\n', i)
+            i = len(style_string) if end == -1 else end
+            continue
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            options.append(current.strip())
+            current = ''
+            i += 1
+            continue
+        current += c
+        i += 1
+    options.append(current.strip())
+    return [option for option in options if option]
+
+
+def style_sheet(style_string):
+    """TeX code defining the styles in `style_string` and the style style_sheet_name(style_string).
+
+    The annex_* styles are defined directly, so that a figure does not
+    have to define them again. The other options (e.g., every
+    node/.style) only apply within the figures, so they go into the
+    style style_sheet_name(style_string), which the figures use. The
+    macro \\annexstylesactive tells the figures which sheet is loaded.
+    """
+    name = style_sheet_name(style_string)
+    annex_styles = []
+    picture_options = []
+    for option in split_styles(style_string):
+        (annex_styles if _annex_style.match(option) else picture_options).append(option)
+    # parameters of the styles become parameters of the nested definitions
+    return "\\tikzset{%s}\n\\tikzset{%s/.style={%s}}\n\\def\\annexstylesactive{%s}\n" % (
+        ',\n'.join(annex_styles), name, ',\n'.join(picture_options).replace('#', '##'), name)
 
 
 class AnnexStyle(yaml.YAMLObject):
+    yaml_loader = yaml_loaders()
     yaml_tag = None
     default_placeholders = dict()
     placeholders = dict()
 
+    def __repr__(self):
+        return f"""<{self.yaml_tag}>"""
+
     def get_style(self):
-        placeholders = self.default_placeholders
+        placeholders = dict(self.default_placeholders)
         placeholders.update(self.placeholders)
-        style = getattr(self, 'style', '')
-        # Check for missing replacements (to avoid confusing TeX errors)
-        for occurence in re.finditer(r'{\|([^|]*)\|}', style):
-            placeholder = occurence.groups()[0]
-            if placeholder not in placeholders:
-                raise Exception(f"undefined placeholder '{placeholder}' for {self.yaml_tag}")
-        for placeholder, replacement in placeholders.items():
-            style = style.replace(f'{{|{placeholder}|}}', replacement)
-        return style.strip().strip(',')
+        return resolve_style(self.yaml_tag, getattr(self, 'style', ''), tuple(placeholders.items()))
 
 
 class StyleCustom(AnnexStyle):
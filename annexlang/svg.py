@@ -0,0 +1,457 @@
+import re
+from html import escape
+
+from .tikzpicture import TikzPicture
+from .steptable import HAS_HEIGHT
+
+# Approximate sizes of TeX units in pt (which we use as SVG user unit),
+# assuming a 10pt document font and an article-like text width.
+UNITS = {
+    'pt': 1.0,
+    'bp': 1.00375,
+    'mm': 2.84528,
+    'cm': 28.4528,
+    'in': 72.27,
+    'ex': 4.3,
+    'em': 10.0,
+    'textwidth': 345.0,
+    'linewidth': 345.0,
+    'columnwidth': 345.0,
+    'baselineskip': 12.0,
+}
+
+FONT_SIZE = 6.0
+CHAR_WIDTH = 0.55 * FONT_SIZE
+LINE_HEIGHT = 2 * UNITS['ex']
+BOX_PADDING = 4.0
+MARGIN = 10.0
+
+STYLESHEET = """
+text { font-family: sans-serif; font-size: 6px; fill: black; }
+line, path { stroke: #80ff00; fill: none; }
+.annex_lifeline { stroke: #b3b3b3; }
+.annex_message, .annex_out_of_scope_message, .annex_http_request, .annex_http_response { stroke: purple; }
+.annex_xhr_request, .annex_xhr_response { stroke: blue; }
+.annex_websocket, .annex_postmessage { stroke: red; }
+.annex_out_of_scope_message, .annex_postmessage, .annex_open_window_start_party_arrow,
+.annex_close_window_end_party_arrow, .annex_separator { stroke-dasharray: 3 2; }
+.annex_separator { stroke: blue; }
+.annex_start_party_box, .annex_end_party_box, .annex_open_window_start_party_box,
+.annex_close_window_end_party_box { fill: white; stroke: black; }
+.annex_action { fill: white; stroke: none; }
+.annex_group_box { fill: none; stroke: #808080; stroke-dasharray: 3 2; }
+.annex_condensed_box { fill: none; stroke: blue; }
+.annex_postmessage_text { fill: red; }
+.annex_comment_text { font-weight: bold; }
+.annex_multistep_caption_text { fill: blue; }
+.annex_step_number { fill: blue; stroke: none; }
+.annex_step_number_text { fill: white; font-weight: bold; }
+"""
+
+# Arrow heads used by the step types (default: filled arrow head)
+OPEN_HEADS = {'http_response', 'xhr_response'}
+
+_length_token = re.compile(r'\s*(?:(\d+\.?\d*|\.\d+)|\\?([A-Za-z]+)|([-+*/()]))')
+
+
+def tex_length(expression):
+    """Approximate value in pt of a TeX length expression like '2ex+1.6ex' or '0.1\\textwidth/2'."""
+    tokens = []
+    expression = str(expression).strip()
+    pos = 0
+    while pos < len(expression):
+        m = _length_token.match(expression, pos)
+        if not m:
+            raise ValueError(f"cannot parse length '{expression}'")
+        pos = m.end()
+        number, unit, operator = m.groups()
+        if number:
+            tokens.append(float(number))
+        elif unit:
+            if unit not in UNITS:
+                raise ValueError(f"unknown unit '{unit}' in length '{expression}'")
+            tokens.append(('unit', UNITS[unit]))
+        else:
+            tokens.append(operator)
+    tokens.append(None)
+    position = 0
+
+    def peek():
+        return tokens[position]
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def expr():
+        value = term()
+        while peek() in ('+', '-'):
+            value = value + term() if take() == '+' else value - term()
+        return value
+
+    def term():
+        value = factor()
+        while peek() in ('*', '/'):
+            value = value * factor() if take() == '*' else value / factor()
+        return value
+
+    def factor():
+        token = take()
+        if token == '-':
+            return -factor()
+        if token == '(':
+            value = expr()
+            take()
+            return value
+        if isinstance(token, tuple):
+            return token[1]
+        if isinstance(token, float):
+            if isinstance(peek(), tuple):
+                return token * take()[1]
+            return token
+        raise ValueError(f"cannot parse length '{expression}'")
+
+    return expr()
+
+
+def tex_to_lines(tex):
+    """Rough plain text version of TeX code, split into lines."""
+    text = re.sub(r'\\contour\{[^}]*\}', '', str(tex))
+    lines = []
+    for line in re.split(r'\\\\|\n', text):
+        line = re.sub(r'\\fa[A-Za-z]+\s*', '', line)  # fontawesome icons
+        line = line.replace('\\ ', ' ')
+        line = re.sub(r'\\([_&%$#{}])', r'\1', line)
+        line = re.sub(r'\\[A-Za-z]+\*?', '', line)
+        line = re.sub(r'[{}$]', '', line).replace('~', ' ')
+        lines.append(line.strip())
+    return lines
+
+
+class BoundingBox:
+    def __init__(self, x1, y1, x2, y2):
+        self.x1, self.y1, self.x2, self.y2 = min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+
+    def union(self, other):
+        if other is None:
+            return self
+        return BoundingBox(min(self.x1, other.x1), min(self.y1, other.y1), max(self.x2, other.x2), max(self.y2, other.y2))
+
+    def anchor(self, name):
+        """Point of the box for a TikZ anchor name like 'north west'."""
+        name = str(name)
+        x = self.x2 if 'east' in name else self.x1 if 'west' in name else (self.x1 + self.x2) / 2
+        y = self.y1 if 'north' in name else self.y2 if 'south' in name else (self.y1 + self.y2) / 2
+        return x, y
+
+
+class SvgPicture:
+    """Renders a protocol directly to SVG, without TeX.
+
+    The matrix layout of the TikZ output is recomputed in Python from the
+    lines and columns of the steps and their heights, using approximate
+    sizes for TeX units and text. Each step draws itself in its svg()
+    (and svg_markers()) method, using the drawing functions of this
+    class. The result is meant for quick previews, not as a replacement
+    for the TikZ output.
+    """
+
+    options = dict(TikzPicture.options, svg_css='')
+    layers = ('groups', 'arrows', 'main', 'markers')
+    dump_debug = TikzPicture.dump_debug
+
+    def __init__(self, annexfile, options=None, stats=None):
+        self.options = dict(self.options)
+        self.options.update(annexfile['options'])
+        self.options.update(options or {})
+        self.protocol = annexfile['protocol']
+        self.protocol.init(self.options, None if stats is None else stats.phase)
+        if stats is not None:
+            stats.count_steps(self.protocol)
+        self.layout()
+
+    def layout(self):
+        protocol = self.protocol
+        colsep = self.length(self.options['colsep'], 1.75 * UNITS['ex'])
+        rowsep = self.length(self.options['rowsep'], 4 * UNITS['ex'])
+
+        # Columns: origins are colsep (plus extra width) apart
+        self.columns = []
+        x = 0.0
+        for column in protocol.columns:
+            self.columns.append(x)
+            x += colsep
+            if 'extrawidth' in column:
+                x += self.length(column['extrawidth'], 0) / 2
+
+        # Rows: determined by the extents of the heights of the steps in each row
+        num_lines = protocol.line + protocol.length
+        above = [0.0] * num_lines
+        below = [0.0] * num_lines
+        for step in protocol.table.with_flag(HAS_HEIGHT):
+            height = step.matrix_height
+            if height is None or not isinstance(height, (tuple, list)):
+                continue
+            up, down = self.extent(*height)
+            above[step.line] = max(above[step.line], up)
+            below[step.line] = max(below[step.line], down)
+        if protocol.has_groups:
+            above[0] = below[0] = UNITS['em']
+        self.rows = []
+        y = 0.0
+        for line in range(num_lines):
+            y += above[line]
+            self.rows.append(y)
+            y += below[line] + rowsep
+
+    def length(self, expression, default):
+        try:
+            return tex_length(expression)
+        except (ValueError, ZeroDivisionError):
+            return default
+
+    def extent(self, height, anchor):
+        """Extent (above, below) of a dummy height node around the origin of its row."""
+        h = self.length(height, 0)
+        parts = str(anchor).split(',')
+        yshift = 0.0
+        for part in parts[1:]:
+            key, _, value = part.partition('=')
+            if key.strip() == 'yshift':
+                yshift = self.length(value, 0)
+        base = parts[0].strip()
+        if base == 'north':
+            top, bottom = yshift, yshift - h
+        elif base == 'south':
+            top, bottom = yshift + h, yshift
+        else:
+            top, bottom = yshift + h / 2, yshift - h / 2
+        return max(top, 0), max(-bottom, 0)
+
+    def pos(self, column, line):
+        return self.columns[column], self.rows[line]
+
+    def half_line_y(self, half_line):
+        # lifeline segments are given in half lines (see StartParty)
+        if half_line % 2 == 0:
+            return self.rows[half_line // 2]
+        return (self.rows[half_line // 2] + self.rows[half_line // 2 + 1]) / 2
+
+    # Drawing functions. Everything that is drawn extends the bounding box
+    # of the current step (unless track is False) and of the given parties,
+    # which are used to fit the boxes of condensed steps and groups.
+
+    def _add(self, layer, element, box, parties=(), track=True):
+        if element is not None:
+            self.output[layer].append(element)
+        if track and self.current is not None:
+            index = self.current._index
+            self.step_boxes[index] = box.union(self.step_boxes.get(index))
+        for party in parties:
+            self.party_boxes[party] = box.union(self.party_boxes.get(party))
+        self.bbox = box.union(self.bbox)
+        return box
+
+    @staticmethod
+    def css(*classes):
+        """CSS classes for TikZ style names; options like 'yshift=1ex' are dropped."""
+        names = []
+        for cls in classes:
+            for name in str(cls or '').split(','):
+                name = name.strip()
+                if name and '=' not in name:
+                    names.append(re.sub(r'[^A-Za-z0-9_-]', '_', name))
+        return ' '.join(names)
+
+    def mark(self, x, y, parties=()):
+        """An invisible point, like an empty TikZ node."""
+        return self._add(None, None, BoundingBox(x, y, x, y), parties)
+
+    def line(self, x1, y1, x2, y2, css, head=None, tail=None, layer='arrows', track=True):
+        markers = ''
+        if head:
+            markers += f' marker-end="url(#annex-{head})"'
+        if tail:
+            markers += f' marker-start="url(#annex-{tail})"'
+        element = f'<line x1="{x1:.2f}" y1="{y1:.2f}" x2="{x2:.2f}" y2="{y2:.2f}" class="{css}"{markers}/>'
+        return self._add(layer, element, BoundingBox(x1, y1, x2, y2), track=track)
+
+    def text(self, x, y, lines, css='', align='middle', valign='baseline', layer='main', parties=()):
+        """Text at x, y; y is the baseline of the first (valign='baseline') or
+        last line ('bottom'), the top ('top') or the center ('middle')."""
+        if isinstance(lines, str):
+            lines = tex_to_lines(lines)
+        if not lines:
+            return None
+        extra = (len(lines) - 1) * LINE_HEIGHT
+        if valign == 'top':
+            y += FONT_SIZE
+        elif valign == 'middle':
+            y += FONT_SIZE / 3 - extra / 2
+        elif valign == 'bottom':
+            y -= extra
+        width = max(len(line) for line in lines) * CHAR_WIDTH
+        spans = ''.join(
+            f'<tspan x="{x:.2f}" y="{y + i * LINE_HEIGHT:.2f}">{escape(line)}</tspan>'
+            for i, line in enumerate(lines)
+        )
+        css = f' class="{css}"' if css else ''
+        element = f'<text text-anchor="{align}"{css}>{spans}</text>'
+        x1 = x - width / 2 if align == 'middle' else x - width if align == 'end' else x
+        box = BoundingBox(x1, y - FONT_SIZE, x1 + width, y + extra + FONT_SIZE / 3)
+        return self._add(layer, element, box, parties)
+
+    def rect(self, box, css, rounded=2.0, layer='main', parties=()):
+        element = (f'<rect x="{box.x1:.2f}" y="{box.y1:.2f}" width="{box.x2 - box.x1:.2f}" '
+                   f'height="{box.y2 - box.y1:.2f}" rx="{rounded:.2f}" class="{css}"/>')
+        return self._add(layer, element, box, parties)
+
+    def box(self, x, y, text, css, number=None, scale=1.0, rounded=2.0, layer='main', parties=()):
+        """A node with text (and the step number, if any) centered at x, y."""
+        lines = tex_to_lines(text)
+        size = FONT_SIZE * scale
+        width = max([len(line) for line in lines] + [1]) * CHAR_WIDTH * scale + 2 * BOX_PADDING * scale
+        height = len(lines) * LINE_HEIGHT * scale + BOX_PADDING * scale
+        box = BoundingBox(x - width / 2, y - height / 2, x + width / 2, y + height / 2)
+        baseline = y + size / 3 - (len(lines) - 1) * LINE_HEIGHT * scale / 2
+        element = [
+            f'<g class="{css}">',
+            f'<rect x="{box.x1:.2f}" y="{box.y1:.2f}" width="{width:.2f}" height="{height:.2f}" rx="{rounded:.2f}"/>',
+        ]
+        for i, line in enumerate(lines):
+            element.append(
+                f'<text text-anchor="middle" x="{x:.2f}" y="{baseline + i * LINE_HEIGHT * scale:.2f}" '
+                f'style="font-size: {size:.2f}px">{escape(line)}</text>'
+            )
+        element.append('</g>')
+        self._add(layer, ''.join(element), box, parties)
+        if number is not None:
+            self.number(box.x1, y, number, layer=layer)
+        return box
+
+    def number(self, x, y, number, align='end', layer='main'):
+        """Badge with a step number, vertically centered at y."""
+        width = len(number) * CHAR_WIDTH + 3
+        x1 = x - width if align == 'end' else x - width / 2 if align == 'middle' else x
+        box = BoundingBox(x1, y - FONT_SIZE / 2 - 1, x1 + width, y + FONT_SIZE / 2 + 1)
+        self.rect(box, 'annex_step_number', rounded=0, layer=layer)
+        self.text(x1 + width / 2, y, [number], 'annex_step_number_text', valign='middle', layer=layer)
+        return box
+
+    # Helpers for the svg() methods of the steps
+
+    def step_number(self, step):
+        """The number shown for a step (see ProtocolStep.tex_id), or None."""
+        if not self.options['enumerate'] or step.skip_number or not hasattr(step, '_counter'):
+            return None
+        return str(step._counter)
+
+    def step_box(self, step):
+        """Bounding box of everything drawn so far for `step`."""
+        return self.step_boxes.get(step._index)
+
+    def subtree_box(self, step):
+        """Bounding box of everything drawn for the steps inside a MultiStep."""
+        box = None
+        for index in range(step._index + 1, step._index_end):
+            if index in self.step_boxes:
+                box = self.step_boxes[index].union(box)
+        return box
+
+    def party_box(self, party):
+        return self.party_boxes.get(party)
+
+    def fit(self, items, inner_sep='0.3333em'):
+        """Box around the given boxes and points (x, y), like TikZ's fit; None is skipped."""
+        box = None
+        for item in items:
+            if isinstance(item, tuple):
+                item = BoundingBox(*item, *item)
+            if item is not None:
+                box = item.union(box)
+        sep = self.length(inner_sep, 0)
+        return BoundingBox(box.x1 - sep, box.y1 - sep, box.x2 + sep, box.y2 + sep)
+
+    def message(self, step, src_column, dest_column, type, **kwargs):
+        """An arrow of the given type between two columns in the line of `step`."""
+        x1, _ = self.pos(src_column, step.line)
+        x2, _ = self.pos(dest_column, step.line)
+        self.arrow(step, x1, x2, type, **kwargs)
+
+    def arrow(self, step, x1, x2, type, above=None, below=None, shift='0ex'):
+        """A horizontal arrow in the line of `step`, styled as annex_<type>,
+        with the text above and below the step (or the given lines)."""
+        y = self.rows[step.line] - self.length(shift, 0)
+        head = 'open' if type in OPEN_HEADS else 'arrow'
+        tail = None
+        if type.endswith('_reversed'):
+            head, tail = None, head
+        self.line(x1, y, x2, y, self.css(f'annex_{type}', step.style), head=head, tail=tail)
+        self.captions(step, (x1 + x2) / 2, y, above, below)
+
+    def captions(self, step, x, y, above=None, below=None):
+        above = [line for text in (step.lines_above if above is None else above) for line in tex_to_lines(text)]
+        below = step.lines_below if below is None else below
+        css = self.css(step.text_style)
+        number = self.step_number(step) if getattr(step, 'id_above', False) else None
+        if above:
+            box = self.text(x, y - 2.6, above, css, valign='bottom', layer='arrows')
+            if number:
+                first_line = y - 2.6 - (len(above) - 1) * LINE_HEIGHT
+                self.number(box.x1 - 1, first_line - FONT_SIZE / 3, number, layer='arrows')
+        elif number:
+            self.number(x, y - 2.6 - FONT_SIZE / 2, number, align='middle', layer='arrows')
+        for i, line in enumerate(below):
+            self.text(x, y + 8 + 8 * i, line, css, layer='arrows')
+
+    def notes(self, step, left, right, y):
+        css = self.css('annex_note', step.note_style)
+        if hasattr(step, 'note_right'):
+            self.text(right + 1, y, str(step.note_right).strip(), css, align='start', valign='middle', layer='markers')
+        if hasattr(step, 'note_left'):
+            self.text(left - 1, y, str(step.note_left).strip(), css, align='end', valign='middle', layer='markers')
+
+    # Output
+
+    def render(self):
+        self.output = {layer: [] for layer in self.layers}
+        self.step_boxes = {}
+        self.party_boxes = {}
+        self.bbox = None
+
+        steps = list(self.protocol.walk())
+        for step in steps:
+            self.current = step
+            step.svg(self)
+        for step in steps:
+            self.current = step
+            step.svg_markers(self)
+        self.current = None
+        if self.protocol.has_groups:
+            for group in self.protocol.groups:
+                group.svg(self)
+
+        bbox = self.bbox or BoundingBox(0, 0, 0, 0)
+        x, y = bbox.x1 - MARGIN, bbox.y1 - MARGIN
+        width, height = bbox.x2 - bbox.x1 + 2 * MARGIN, bbox.y2 - bbox.y1 + 2 * MARGIN
+        out = [
+            f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="{x:.2f} {y:.2f} {width:.2f} {height:.2f}" '
+            f'width="{width:.2f}pt" height="{height:.2f}pt">',
+            '<defs>',
+            '<marker id="annex-arrow" viewBox="0 0 10 10" refX="10" refY="5" markerWidth="5" markerHeight="5" '
+            'orient="auto-start-reverse"><path d="M0,0 L10,5 L0,10 z" style="fill: context-stroke; stroke: none"/></marker>',
+            '<marker id="annex-open" viewBox="0 0 10 10" refX="10" refY="5" markerWidth="5" markerHeight="5" '
+            'orient="auto-start-reverse"><path d="M0,0 L10,5 L0,10 z" style="fill: white; stroke: context-stroke"/></marker>',
+            f'<style>{STYLESHEET}{self.options["svg_css"]}</style>',
+            '</defs>',
+        ]
+        for layer in self.layers:
+            out.append(f'<g class="annex_layer_{layer}">')
+            out += self.output[layer]
+            out.append('</g>')
+        out.append('</svg>\n')
+        return '\n'.join(out)
+
+    def dump(self, f):
+        f.write(self.render())
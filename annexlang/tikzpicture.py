@@ -1,3 +1,52 @@
+import re
+import json
+import hashlib
+from contextlib import nullcontext
+
+from .profiles import get_profile
+from .externalize import figure_filename, FINGERPRINT_LENGTH
+from .components import cached_property, ex_length
+from .paginate import paginate
+from .styles import style_sheet, style_sheet_name
+from .steptable import HAS_HEIGHT
+
+_position = re.compile(r'pos-\d+-\d+')
+_comment = re.compile(r'(?<!\\)%[^\n]*')
+
+
+def referenced_positions(chunks):
+    """Names of the matrix nodes used in the given TikZ code (not counting comments)."""
+    found = set()
+    for chunk in chunks:
+        found.update(_position.findall(_comment.sub('', chunk)))
+    return found
+
+
+def merge_heights(heights):
+    """Replace the dummy height nodes of a row by a single node with the same extent.
+
+    The extent includes the origin of the row, where the (possibly
+    omitted) matrix nodes are. Only possible if all heights and shifts
+    are given in ex; otherwise, the heights are returned unchanged.
+    """
+    if not heights:
+        return heights
+    top = bottom = 0.0
+    for height, anchor in heights:
+        base, *settings = str(anchor).split(',')
+        h = ex_length(height)
+        yshift = 0.0
+        for setting in settings:
+            key, _, value = setting.partition('=')
+            yshift = ex_length(value) if key.strip() == 'yshift' else None
+        if h is None or yshift is None or base.strip() not in ('north', 'south', 'center'):
+            return heights
+        node_bottom = {'north': -h, 'south': 0, 'center': -h / 2}[base.strip()] + yshift
+        top = max(top, node_bottom + h)
+        bottom = min(bottom, node_bottom)
+    return [(f"{round(top - bottom, 4):g}ex", f"south,yshift={round(bottom, 4):g}ex")]
+
+
 class TikzPicture:
 
     options = {
@@ -6,120 +55,286 @@ class TikzPicture:
         'enumerate': '',
         'styles': [],
         'tex_intro': '',
+        'profile': 'debug',
+        'stable_ids': False,
+        'externalize': None,
+        'page_budget': None,
+        'page_separator': '\n\\par\n',
+        'sparse_matrix': False,
+        'style_sheet': None,
     }
     
-    def __init__(self, annexfile):
+    def __init__(self, annexfile, options=None, stats=None):
+        self.options = dict(self.options)
         self.options.update(annexfile['options'])
+        # options given here take precedence over the ones from the annex file
+        self.options.update(options or {})
+        self.profile = get_profile(self.options)
+        self.stats = stats
         self.protocol = annexfile['protocol']
-        self.protocol.init(self.options)
+        self.protocol.init(self.options, None if stats is None else stats.phase)
+        if stats is not None:
+            stats.count_steps(self.protocol)
+
+    def phase(self, name):
+        return nullcontext() if self.stats is None else self.stats.phase(name)
+
+    def emitted(self, name, code):
+        return code if self.stats is None else self.stats.emitted(name, code)
 
     def dump(self, f):
-        self.dump_header(f)
-        self.dump_matrix(f)
-        self.dump_steps(f)
-        self.dump_footer(f)
+        for chunk in self.chunks():
+            f.write(chunk)
+
+    def chunks(self):
+        """Generate the TikZ code in a few large chunks (header, matrix, one per layer, footer).
+
+        Useful for streaming the output, e.g., to a socket or a compressed file.
+        With the page_budget option, the protocol is split into several
+        pictures (see paginate.py), separated by the page_separator.
+        """
+        if not self.options['page_budget']:
+            yield from self.picture_chunks()
+            return
+        for page in paginate(self.protocol, self.options['page_budget']):
+            if page.continued:
+                yield self.options['page_separator']
+            yield from self.picture_chunks(page)
+
+    def picture_chunks(self, page=None):
+        if not self.options['externalize'] and not self.options['sparse_matrix']:
+            yield self.emitted('header', self.render_header())
+            with self.phase('render matrix'):
+                matrix = self.render_matrix(page)
+            yield self.emitted('matrix', matrix)
+            yield from self.render_layers(page)
+            yield self.emitted('footer', self.render_footer())
+            return
+
+        # The file name of an externalized figure contains a fingerprint of
+        # its contents, so we need to render the picture before the header.
+        if self.options['sparse_matrix']:
+            # The matrix only contains the positions used in the layers.
+            # Computing the heights may create nodes, so do it first, as usual.
+            self.matrix_dummy_heights
+            layers = list(self.render_layers(page))
+            with self.phase('render matrix'):
+                matrix = self.render_matrix(page, referenced_positions(layers))
+        else:
+            with self.phase('render matrix'):
+                matrix = self.render_matrix(page)
+            layers = list(self.render_layers(page))
+        body = [self.emitted('matrix', matrix)] + layers
+        if self.options['externalize']:
+            self.fingerprint = self.compute_fingerprint(body)
+        yield self.emitted('header', self.render_header(page))
+        yield from body
+        yield self.emitted('footer', self.render_footer())
 
     def dump_header(self, f):
-        f.write(self.options['tex_intro'])
-        style_string = ','.join(
+        f.write(self.render_header())
+
+    def dump_matrix(self, f):
+        f.write(self.render_matrix())
+
+    def dump_steps(self, f):
+        for chunk in self.render_layers():
+            f.write(chunk)
+
+    def dump_footer(self, f):
+        f.write(self.render_footer())
+
+    @cached_property
+    def style_string(self):
+        return ','.join(
             s.get_style() for s in self.options['styles']
         )
-        f.write(r"""
+
+    @property
+    def style_sheet(self):
+        """TeX code for the shared style sheet (see the style_sheet option)."""
+        return style_sheet(self.style_string)
+
+    def picture_styles(self):
+        if not self.options['style_sheet']:
+            return self.style_string
+        return style_sheet_name(self.style_string)
+
+    def compute_fingerprint(self, body):
+        # everything in the figure except the file name: tex_intro (e.g.,
+        # macros used in the figure), the styles and the body
+        h = hashlib.sha256(self.options['tex_intro'].encode())
+        h.update(b'\0')
+        h.update(self.style_string.encode())
+        for chunk in body:
+            h.update(chunk.encode())
+        return h.hexdigest()[:FINGERPRINT_LENGTH]
+
+    def render_header(self, page=None):
+        out = self.options['tex_intro']
+        if self.options['externalize']:
+            name = self.options['externalize']
+            if page is not None:
+                name += f"-p{page.number}"
+            filename = figure_filename(name, self.fingerprint)
+            # \tikzsetnextfilename is only defined if the external library is loaded
+            out += fr"""
+        % annex fingerprint: {filename}
+        \ifdefined\tikzsetnextfilename\tikzsetnextfilename{{{filename}}}\fi"""
+        if self.options['style_sheet']:
+            # the style sheet is only read if it is not the one loaded last
+            # (e.g., in the preamble)
+            name = style_sheet_name(self.style_string)
+            out += fr"""
+        \def\annexstylesneeded{{{name}}}\ifx\annexstylesneeded\annexstylesactive\else\input{{{self.options['style_sheet']}/{name}}}\fi"""
+        return out + r"""
         \begin{tikzpicture}[%s]
         \pgfdeclarelayer{arrows}
         \pgfdeclarelayer{groups}
         \pgfdeclarelayer{markers}
         \pgfsetlayers{groups,arrows,main,markers}
-        """ % style_string)
+        """ % self.picture_styles()
 
-    def dump_matrix(self, f):
+    @cached_property
+    def matrix_dummy_heights(self):
         line_offset = 1 if self.protocol.has_groups else 0
         lines = self.count_lines()
         matrix_dummy_heights = [[] for i in range(lines + line_offset)]
 
-        for step in self.protocol.walk():
-            if hasattr(step, 'height_overwrite'):
-                matrix_dummy_heights[step.line].append(step.height_overwrite)
-            elif hasattr(step, 'height'):
-                matrix_dummy_heights[step.line].append(step.height)
+        for step in self.protocol.table.with_flag(HAS_HEIGHT):
+            if step.matrix_height is not None:
+                matrix_dummy_heights[step.line].append(step.matrix_height)
+        return matrix_dummy_heights
 
-        f.write(r"""
+    def render_matrix(self, page=None, referenced=None):
+        """The matrix with the positions of all lines and columns (of the protocol or one page).
+
+        If `referenced` is given, only these positions are emitted (plus
+        all positions in the first row, which fix the columns), and the
+        dummy heights of each row are merged where possible.
+        """
+        matrix_dummy_heights = self.matrix_dummy_heights
+        out = [r"""
         %% MATRIX
         \matrix [column sep={%(colsep)s,between origins}, row sep=%(rowsep)s]
         {
-        """ % self.options)
+        """ % self.options]
+
+        # The column separators (and extra widths) are the same in each row
+        columns = self.protocol.columns
+        separators = []
+        for i in range(len(columns)): # we need to be able to refer to the following column, hence, we use this kind of iteration
+            col = columns[i]
+            extrawidths = []
+            if 'extrawidth' in col:
+                extrawidths.append(col['extrawidth'] + "/2")
+            if i < (len(columns) - 1) and hasattr(columns[i+1], 'extrawidth'):
+                extrawidths.append(columns[i+1]['extrawidth'] + "/2")
+            separator = ""
+            if i < (len(columns) - 1):
+                separator = r""" &"""
+                if extrawidths:
+                    separator += f"[{'+'.join(extrawidths)}]"
+            separators.append(separator)
 
         # Draw the matrix (no real node contents yet)
-        for line in range(len(matrix_dummy_heights)):
-            for i in range(len(self.protocol.columns)): # we need to be able to refer to the following column, hence, we use this kind of iteration
-                col = self.protocol.columns[i]
+        if page is None:
+            rows = enumerate(matrix_dummy_heights)
+        else:
+            rows = page.rows(matrix_dummy_heights)
+        for row, (line, heights) in enumerate(rows):
+            for i in range(len(columns)):
                 position = self.protocol.get_pos(i, line)
-                f.write(r"""\node[annex_matrix_node,inner sep=0,outer sep=0](%s){};""" % (position,))
-                
-                extrawidths = []
-                if 'extrawidth' in col:
-                    extrawidths.append(col['extrawidth'] + "/2")
-                if i < (len(self.protocol.columns) - 1) and hasattr(self.protocol.columns[i+1], 'extrawidth'):
-                    extrawidths.append(self.protocol.columns[i+1]['extrawidth'] + "/2")
-                if i < (len(self.protocol.columns) - 1):
-                    f.write(r""" &""")
-                    if extrawidths:
-                        f.write(f"[{'+'.join(extrawidths)}]")
-                    
+                if referenced is None or row == 0 or position in referenced:
+                    out.append(r"""\node[annex_matrix_node,inner sep=0,outer sep=0](%s){};""" % (position,))
+                out.append(separators[i])
+            if referenced is not None:
+                heights = merge_heights(heights)
+
             if self.protocol.has_groups and line == 0:
-                f.write(r"""\node[annex_group_title_placeholder,minimum height=2em]{};""")
+                out.append(r"""\node[annex_group_title_placeholder,minimum height=2em]{};""")
             else:
-                for height, anchor in matrix_dummy_heights[line]:
-                    f.write(
+                for height, anchor in heights:
+                    out.append(
                         fr"""\node[annex_matrix_dummy_height,minimum height={height},anchor={anchor}]{{}};""")
-            f.write(r"""\\""")
-            f.write("\n")
+            out.append(r"""\\""" + "\n")
 
-        f.write("};\n")
+        out.append("};\n")
+        return ''.join(out)
 
-    def dump_steps(self, f):
-        f.write("\n% MAIN LAYER\n\n")
-        for step in self.protocol.walk():
-            f.write(step.tikz_desc())
-            f.write("\n")
-            f.write(step.tikz())
-            f.write("\n\n")
-            
-        f.write("\n% ARROWS LAYER\n\n")
-        f.write(r"""\begin{pgfonlayer}{arrows}""")
-        for step in self.protocol.walk():
-            f.write(step.tikz_desc())
-            f.write("\n")
-            f.write(step.tikz_arrows())
-            f.write("\n\n")
-        f.write(r"""\end{pgfonlayer}""")
+    def render_layers(self, page=None):
+        """Generate the TikZ code for each layer (of the whole protocol or one page).
+
+        The protocol is traversed only once, filling the main and arrows
+        layers. Groups and markers are rendered afterwards since they
+        fit around nodes that are only created by the other layers.
+        """
+        steps = []
+        main = ["\n% MAIN LAYER\n\n"]
+        arrows = ["\n% ARROWS LAYER\n\n", r"""\begin{pgfonlayer}{arrows}"""]
+        self.protocol.visible_half_lines = None if page is None else page.visible_half_lines
+        if page is not None:
+            for start in page.carried:
+                main.append(start.party.tikz_continued(page.header_line) + "\n")
+                arrows.append(start.tikz_lifeline(self.protocol.visible_segments(start.lifeline_segments)))
+        with self.phase('render main and arrows'):
+            for step in (self.protocol.walk() if page is None else page.walk()):
+                steps.append(step)
+                self.render_step(main, 'main', step, step.tikz)
+                self.render_step(arrows, 'arrows', step, step.tikz_arrows)
+            arrows.append(r"""\end{pgfonlayer}""")
+        yield self.emitted('main', ''.join(main))
+        yield self.emitted('arrows', ''.join(arrows))
 
         if self.protocol.has_groups:
-            f.write("\n% GROUPS LAYER\n\n")
-            f.write(r"""\begin{pgfonlayer}{groups}""")
-            for group in self.protocol.groups:
-                f.write(group.tikz_desc())
-                f.write("\n")
-                f.write(group.tikz_groups(self.count_lines()))
-                f.write("\n\n")
-            f.write(r"""\end{pgfonlayer}""")
-
-        f.write("\n% MARKERS LAYER\n\n")
-        f.write(r"""\begin{pgfonlayer}{markers}""")
-        for step in self.protocol.walk():
-            f.write(step.tikz_desc())
-            f.write("\n")
-            f.write(step.tikz_notes())
-            f.write("\n")
-            f.write(step.tikz_markers())
-            f.write("\n\n")
-        f.write(r"""\end{pgfonlayer}""")
+            with self.phase('render groups'):
+                out = ["\n% GROUPS LAYER\n\n", r"""\begin{pgfonlayer}{groups}"""]
+                for group in self.protocol.groups:
+                    self.render_step(out, 'groups', group, lambda: group.tikz_groups(self.count_lines(), page))
+                out.append(r"""\end{pgfonlayer}""")
+            yield self.emitted('groups', ''.join(out))
 
-    def dump_footer(self, f):
-        f.write(r"""
+        with self.phase('render markers'):
+            out = ["\n% MARKERS LAYER\n\n", r"""\begin{pgfonlayer}{markers}"""]
+            for step in steps:
+                self.render_step(out, 'markers', step, step.tikz_notes, step.tikz_markers)
+            out.append(r"""\end{pgfonlayer}""")
+        yield self.emitted('markers', ''.join(out))
+
+    def render_step(self, out, layer, step, *parts):
+        # The parts are functions returning TikZ code; they are only called
+        # after the description was created, since they may modify the step.
+        comments = self.profile['comments'][layer]
+        if comments == 'full':
+            out.append(step.tikz_desc())
+            out.append("\n")
+            out.append("\n".join(part() for part in parts))
+            out.append("\n\n")
+        else:
+            if comments:
+                out.append(step.tikz_desc(verbose=False))
+                out.append("\n")
+            for part in parts:
+                text = part()
+                if text:
+                    out.append(text)
+                    out.append("\n")
+
+    def render_footer(self):
+        return r"""
         \end{tikzpicture}
         """
-        )
+
+    def dump_debug(self, f):
+        """Write the attributes of all steps as JSON, e.g., to a sidecar file."""
+        json.dump([
+            {
+                'annexid': step.annexid,
+                'type': step.__class__.__name__,
+                'line': step.line,
+                'attributes': {key: repr(value) for key, value in step.debug_attributes().items()},
+            } for step in self.protocol.walk()
+        ], f, indent=1)
 
     def count_lines(self):
         return self.protocol.length
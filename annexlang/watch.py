@@ -0,0 +1,76 @@
+import os
+import time
+import traceback
+
+from .convert import convert, load_custom_objects, custom_objects_filename
+
+
+def _mtime(filename):
+    try:
+        return os.stat(filename).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def watch(tasks, cache=None, interval=0.5, report=print, **kwargs):
+    """Keep converting annex files whenever they change.
+
+    `tasks` maps input files to output files. The input files and the
+    annex_custom.py files next to them are polled every `interval`
+    seconds, as well as the files they include with !include. A changed
+    input file (or included file) is converted again; a changed
+    annex_custom.py is executed again (so that new or modified step
+    classes are registered) and all input files in its directory are
+    converted again. Errors are reported and do not stop watching.
+    Further keyword arguments are passed to convert(). Runs until
+    interrupted.
+    """
+    customs = {}
+    for infile in tasks:
+        directory = os.path.dirname(infile)
+        customs.setdefault(custom_objects_filename(directory), (directory, []))[1].append(infile)
+
+    includes = {infile: () for infile in tasks}  # files included by each input file
+    mtimes = {}
+    first = True
+    while True:
+        changed = []
+        for custom, (directory, infiles) in customs.items():
+            mtime = _mtime(custom)
+            if not first and mtime != mtimes[custom]:
+                report(f"{custom} changed, reloading")
+                try:
+                    load_custom_objects(directory, reload=True)
+                except Exception:
+                    report(traceback.format_exc())
+                changed += infiles
+            mtimes[custom] = mtime
+
+        for infile in tasks:
+            mtime = _mtime(infile)
+            if first or mtime != mtimes.get(infile):
+                changed.append(infile)
+            mtimes[infile] = mtime
+
+        included = {}
+        for infile, filenames in includes.items():
+            for filename in filenames:
+                included.setdefault(filename, []).append(infile)
+        for filename, infiles in included.items():
+            mtime = _mtime(filename)
+            if filename in mtimes and mtime != mtimes[filename]:
+                changed += infiles
+            mtimes[filename] = mtime
+
+        for infile in dict.fromkeys(changed):
+            outfile = tasks[infile]
+            try:
+                infile_includes = {}
+                if convert(infile, outfile, cache, includes=infile_includes, **kwargs):
+                    report(f"{infile} -> {outfile}")
+                includes[infile] = tuple(infile_includes)
+            except Exception:
+                report(f"{infile}: FAILED\n{traceback.format_exc()}")
+
+        first = False
+        time.sleep(interval)
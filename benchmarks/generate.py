@@ -0,0 +1,121 @@
+"""Generator for synthetic annex protocols of any size.
+
+Usage: python -m benchmarks.generate [number of steps] > protocol.yml
+"""
+import random
+import sys
+
+WORDS = ('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit',
+         'sed', 'do', 'eiusmod', 'tempor', 'incididunt', 'ut', 'labore', 'et', 'dolore')
+
+HEADER = """options:
+  enumerate: '\\setcounter{protostep}{%d}\\protostep{%s} '
+  styles:
+    - !style-default {}
+    - !style-custom
+      style: |
+        annex_lifeline_dashed/.style={annex_lifeline,dotted,thick},
+protocol:
+  !Protocol
+"""
+
+
+def text(rng, length):
+    """Some words with a total length of about `length` characters."""
+    words = []
+    while sum(len(w) + 1 for w in words) < length:
+        words.append(rng.choice(WORDS))
+    return ' '.join(words)
+
+
+class Generator:
+    def __init__(self, parties, depth, lifeline_styles, text_length, seed):
+        self.parties = parties
+        self.depth = depth
+        self.lifeline_styles = lifeline_styles
+        self.text_length = text_length
+        self.rng = random.Random(seed)
+        self.num_steps = 0
+
+    def text(self):
+        return text(self.rng, self.text_length)
+
+    def two_parties(self):
+        src, dest = self.rng.sample(range(self.parties), 2)
+        return src, dest
+
+    def leaf(self, indent):
+        self.num_steps += 1
+        src, dest = self.two_parties()
+        kind = self.num_steps % 4
+        if kind == 0:
+            lines = ["!http-request", f"src: *p{src}", f"dest: *p{dest}", "method: GET",
+                     f"url: /{self.text().replace(' ', '/')}", f"parameters: {self.text()}"]
+        elif kind == 1:
+            lines = ["!http-response", f"src: *p{src}", f"dest: *p{dest}", f"parameters: {self.text()}"]
+        elif kind == 2:
+            lines = ["!action", f"party: *p{src}", f"label: {self.text()}"]
+        else:
+            lines = ["!msg", f"src: *p{src}", f"dest: *p{dest}", f"caption: {self.text()}"]
+        return self.item(lines, indent)
+
+    @staticmethod
+    def item(lines, indent):
+        prefix = ' ' * indent
+        return f"{prefix}- {lines[0]}\n" + ''.join(f"{prefix}  {line}\n" for line in lines[1:])
+
+    def block(self, depth, indent, top_level=False):
+        """A step nested `depth` levels deep in Serial and Parallel blocks."""
+        if depth == 0:
+            return self.leaf(indent)
+        kind = '!Serial' if depth % 2 else '!Parallel'
+        lines = [kind]
+        if kind == '!Serial' and top_level and self.lifeline_styles:
+            self.lifeline_styles -= 1
+            lines.append("lifeline_style: annex_lifeline_dashed")
+        lines.append("steps:")
+        out = self.item(lines, indent)
+        for _ in range(2):
+            out += self.block(depth - 1, indent + 4)
+        return out
+
+    def steps(self, num_steps):
+        out = ''
+        while self.num_steps < num_steps:
+            out += self.block(self.depth, 2, top_level=True)
+        return out
+
+
+def protocol(parties=4, steps=100, depth=0, groups=0, lifeline_styles=0, text_length=10, seed=0):
+    """YAML source of a random protocol.
+
+    The protocol has `parties` parties and (at least) `steps` messages
+    and actions, nested in Serial and Parallel blocks `depth` levels
+    deep. The first `groups` groups contain two parties each, the first
+    `lifeline_styles` top-level Serial blocks (depth must be odd) get a
+    dashed lifeline. Captions have about `text_length` characters. The
+    same parameters always give the same protocol.
+    """
+    if parties < 2:
+        raise Exception("a protocol needs at least two parties")
+    generator = Generator(parties, depth, lifeline_styles, text_length, seed)
+    out = HEADER + "  parties:\n"
+    for i in range(parties):
+        out += f"  - &p{i}\n    !Party\n    name: Party {i}\n"
+    if groups:
+        out += "  groups:\n"
+        for g in range(min(groups, parties // 2)):
+            out += f"  - !Group\n    name: Group {g}\n    parties:\n      - *p{2 * g}\n      - *p{2 * g + 1}\n"
+    out += "  steps:\n"
+    out += generator.item(["!Parallel", "steps:"], 2)
+    for i in range(parties):
+        out += generator.item(["!start-party", f"party: *p{i}"], 6)
+    out += generator.steps(steps)
+    out += generator.item(["!Parallel", "steps:"], 2)
+    for i in range(parties):
+        out += generator.item(["!end-party", f"party: *p{i}"], 6)
+    return out
+
+
+if __name__ == '__main__':
+    sys.stdout.write(protocol(steps=int(sys.argv[1]) if len(sys.argv) > 1 else 100))
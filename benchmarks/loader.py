@@ -0,0 +1,36 @@
+"""Compare the pure Python YAML loader with the libyaml-based AnnexLoader.
+
+Usage: python -m benchmarks.loader [number of steps ...]
+"""
+import sys
+import time
+
+import yaml
+
+from annexlang.loader import AnnexLoader, LIBYAML
+
+from .generate import protocol
+
+
+def timed(src, loader, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        yaml.load(src, Loader=loader)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def main(sizes):
+    print(f"libyaml available: {LIBYAML}")
+    print(f"{'steps':>8} {'yaml.Loader':>12} {'AnnexLoader':>12} {'speedup':>8}")
+    for num_steps in sizes:
+        src = protocol(parties=2, steps=num_steps)
+        slow = timed(src, yaml.Loader)
+        fast = timed(src, AnnexLoader)
+        print(f"{num_steps:>8} {slow:>11.3f}s {fast:>11.3f}s {slow / fast:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main([int(n) for n in sys.argv[1:]] or [500, 1000, 5000])
@@ -0,0 +1,44 @@
+"""Compare the full matrix with the sparse matrix (option sparse_matrix).
+
+Prints the number of TikZ nodes and, if pdflatex is installed, the time
+to compile a protocol with many parties and lines.
+
+Usage: python -m benchmarks.matrix [number of parties] [number of steps]
+"""
+import shutil
+import sys
+import tempfile
+import time
+
+from annexlang import render
+from annexlang.latex import compile_pdf, DEFAULT_ENGINE
+
+from .generate import protocol
+
+
+def timed_compile(tikz, tmpdir):
+    start = time.perf_counter()
+    compile_pdf(tikz, f"{tmpdir}/figure.pdf", DEFAULT_ENGINE, tmpdir)
+    return time.perf_counter() - start
+
+
+def main(num_parties=12, num_steps=800):
+    src = protocol(parties=num_parties, steps=num_steps)
+    compile = shutil.which(DEFAULT_ENGINE) is not None
+    if not compile:
+        print(f"{DEFAULT_ENGINE} not found, only counting nodes")
+    print(f"{num_parties} parties, {num_steps} steps")
+    print(f"{'matrix':>8} {'nodes':>8} {'bytes':>9} {'compile':>9}")
+    with tempfile.TemporaryDirectory(prefix='annex-bench-') as tmpdir:
+        if compile:
+            # build the format before measuring
+            timed_compile(render(src, profile='production'), tmpdir)
+        for sparse in (False, True):
+            tikz = render(src, profile='production', sparse_matrix=sparse)
+            nodes = tikz.count('\\node')
+            seconds = f"{timed_compile(tikz, tmpdir):.2f}s" if compile else '-'
+            print(f"{'sparse' if sparse else 'full':>8} {nodes:>8} {len(tikz):>9} {seconds:>9}")
+
+
+if __name__ == '__main__':
+    main(*[int(n) for n in sys.argv[1:]])
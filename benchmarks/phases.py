@@ -0,0 +1,142 @@
+"""Time each phase of a conversion for synthetic protocols of growing size.
+
+The phases are: YAML load, the phases of Protocol.init() (see
+Protocol.init_phases), dump_matrix and dump_steps (with the rendering
+of each layer, see annexlang.stats). For each size, the
+best of several runs is reported, along with the peak memory of one
+more run (measured with tracemalloc). From the times of consecutive
+sizes, the scaling exponent of each phase is estimated (1 is linear);
+phases growing clearly faster than linearly are marked.
+
+Usage: python -m benchmarks.phases [--steps N ...] [--json FILE] [--compare FILE]
+"""
+import argparse
+import json
+import platform
+import subprocess
+import tracemalloc
+from math import log
+
+from annexlang import __version__
+from annexlang.components import object_numbering
+from annexlang.loader import load
+from annexlang.stats import Stats
+from annexlang.tikzpicture import TikzPicture
+
+from .generate import protocol
+
+# scaling exponents above this are reported as superlinear
+SUPERLINEAR = 1.3
+
+
+class Discard:
+    def write(self, s):
+        pass
+
+
+def run(src):
+    """Convert `src` once, return the duration of each phase."""
+    stats = Stats()
+    with object_numbering():
+        with stats.phase('load'):
+            parsed = load(src)
+        picture = TikzPicture(parsed, {'profile': 'production'}, stats)
+        with stats.phase('dump_matrix'):
+            picture.dump_matrix(Discard())
+        with stats.phase('dump_steps'):
+            picture.dump_steps(Discard())
+    return {phase: record['seconds'] for phase, record in stats.phases.items()}
+
+
+def measure(src, repeat):
+    best = {}
+    for _ in range(repeat):
+        times = run(src)
+        for phase, seconds in times.items():
+            best[phase] = min(seconds, best.get(phase, seconds))
+    tracemalloc.start()
+    try:
+        run(src)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def scaling(results):
+    """Scaling exponent of each phase between consecutive sizes."""
+    out = []
+    for smaller, larger in zip(results, results[1:]):
+        size = log(larger['steps'] / smaller['steps'])
+        out.append({
+            'steps': [smaller['steps'], larger['steps']],
+            'exponents': {
+                phase: round(log(larger['phases'][phase] / smaller['phases'][phase]) / size, 2)
+                for phase in larger['phases']
+                if smaller['phases'].get(phase) and larger['phases'][phase]
+            },
+        })
+    return out
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the phases of annex conversions of synthetic protocols.')
+    parser.add_argument('--steps', type=int, nargs='+', default=[500, 1000, 2000, 4000])
+    parser.add_argument('--parties', type=int, default=6)
+    parser.add_argument('--depth', type=int, default=1, help='Nesting depth of Serial/Parallel blocks.')
+    parser.add_argument('--groups', type=int, default=1)
+    parser.add_argument('--lifeline-styles', type=int, default=10)
+    parser.add_argument('--text-length', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', type=str, default=None, metavar='FILE', help='Write the results to FILE.')
+    parser.add_argument('--compare', type=str, default=None, metavar='FILE',
+                        help='Compare with earlier results (written with --json).')
+    args = parser.parse_args()
+
+    parameters = {'parties': args.parties, 'depth': args.depth, 'groups': args.groups,
+                  'lifeline_styles': args.lifeline_styles, 'text_length': args.text_length}
+    results = []
+    for steps in args.steps:
+        phases, peak = measure(protocol(steps=steps, **parameters), args.repeat)
+        results.append({'steps': steps, 'phases': phases, 'peak_memory': peak})
+        print(f"{steps:>7} steps: " + ' '.join(f"{phase}={seconds * 1000:.1f}ms" for phase, seconds in phases.items())
+              + f" peak={peak / 2 ** 20:.1f}MB")
+
+    curves = scaling(results)
+    for curve in curves:
+        marks = [f"{phase}={exponent}" + (" (!)" if exponent > SUPERLINEAR else "")
+                 for phase, exponent in curve['exponents'].items()]
+        print(f"scaling {curve['steps'][0]}->{curve['steps'][1]}: " + ' '.join(marks))
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = {r['steps']: r for r in json.load(f)['results']}
+        for result in results:
+            if result['steps'] not in old:
+                continue
+            before = old[result['steps']]['phases']
+            ratios = [f"{phase}={seconds / before[phase]:.2f}x" for phase, seconds in result['phases'].items()
+                      if before.get(phase)]
+            print(f"{result['steps']:>7} steps vs. {args.compare}: " + ' '.join(ratios))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'version': __version__,
+                'commit': commit(),
+                'python': platform.python_version(),
+                'parameters': parameters,
+                'results': results,
+                'scaling': curves,
+            }, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
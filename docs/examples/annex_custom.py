@@ -5,8 +5,12 @@ from annexlang.language import Action
 class MyCustomAction(Action):
     yaml_tag = '!my-custom-action'
 
-    def tikz(self):
+    def layout(self):
+        # texts are set before they are laid out
         self.label = "MY CUSTOM ACTION"
+        super().layout()
+
+    def tikz(self):
         pos = self.get_pos(self.party.column, self.line)
         text = self.tex_id + self.contour(self.label)
         out = fr"""\node[annex_action,name={self.node_name}{self.tikz_extra_style}] at ({pos}) {{{text}}};"""
@@ -1,7 +1,12 @@
 from setuptools import setup
+import re
 import sys
-if sys.version_info < (3, 5):
-    raise RuntimeError("This package requres Python 3.5+")
+if sys.version_info < (3, 9):
+    raise RuntimeError("This package requres Python 3.9+")
+
+def version():
+    with open('annexlang/__init__.py') as f:
+        return re.search(r"^__version__ = '([^']*)'", f.read(), re.M).group(1)
 
 def readme():
     with open('README.rst') as f:
@@ -9,7 +14,7 @@ def readme():
 
 setup(
     name='annexlang',
-    version='0.4',
+    version=version(),
     description='A description language for drawing communication protocols in TeX documents.',
     url='http://github.com/webhamster/annexlang',
     author='Daniel Fett',
@@ -24,10 +29,12 @@ setup(
       
     classifiers=[
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
     ],
     long_description=readme(),
     include_package_data=True,
+    python_requires='>=3.9',
 )
-python_requires='>=3.5'
@@ -0,0 +1,37 @@
+import os
+import threading
+
+import pytest
+
+from annexlang.cache import BuildCache, ParseCache
+
+
+def test_parse_cache(tmp_path):
+    cache = ParseCache()
+    infile = os.path.join(str(tmp_path), 'a.yml')
+    assert cache.get(infile, 'key') is None
+    cache.store(infile, 'key', {'protocol': [1, 2]}, {'/x/login.yml': 'digest'})
+    includes = {}
+    # the included file does not exist, so the entry is outdated
+    assert cache.get(infile, 'key', includes) is None
+    cache.store(infile, 'key', {'protocol': [1, 2]})
+    assert cache.get(infile, 'key', includes) == {'protocol': [1, 2]}
+    assert cache.get(infile, 'other key') is None
+
+
+def test_parse_cache_write_errors(tmp_path):
+    infile = os.path.join(str(tmp_path), 'a.yml')
+    # a file where the cache directory would be
+    open(os.path.join(str(tmp_path), '__annexcache__'), 'w').close()
+    with pytest.warns(UserWarning, match='cannot write the parse cache'):
+        ParseCache().store(infile, 'key', {})
+    with pytest.warns(UserWarning, match='cannot write the build cache'):
+        BuildCache().store(infile + '.tex', 'key')
+
+
+def test_parse_cache_unpicklable(tmp_path):
+    cache = ParseCache(str(tmp_path))
+    infile = os.path.join(str(tmp_path), 'a.yml')
+    with pytest.warns(UserWarning, match='cannot write the parse cache'):
+        cache.store(infile, 'key', {'lock': threading.Lock()})
+    assert os.listdir(str(tmp_path)) == []
@@ -0,0 +1,46 @@
+import os
+
+from annexlang.check import check, check_file
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), '..', 'docs', 'examples')
+
+PROTOCOL = """options:
+  styles: [!style-default {}]
+protocol: !Protocol
+  parties:
+  - &a !Party {name: A}
+  - &b !Party {name: B}
+  steps:
+  - !start-party {party: *a}
+  - !start-party {party: *b}
+  - !msg {src: *a, dest: !Party {name: C}, id: one}
+  - !msg {src: *a, dest: *b, id: one, style: annex_nope}
+  - !msg {src: *b, dest: *a, reply_to: *a}
+  - !start-party {party: *a}
+  - !end-party {party: *b}
+"""
+
+
+def test_example_is_clean():
+    assert check_file(os.path.join(EXAMPLES, 'demo.yml')) == []
+
+
+def test_problems():
+    assert check(PROTOCOL) == [
+        (10, "dest: party 'C' is not a party of the protocol (and has no column)"),
+        (11, "duplicate id 'one' (first used in line 10)"),
+        (11, "unknown style 'annex_nope' in style"),
+        (12, "reply_to must refer to a message, not <Party_2>"),
+        (13, "started party 'A' that was already started in line 8"),
+        (8, "started party 'A', but did not end it"),
+    ]
+
+
+def test_yaml_error():
+    # the message depends on whether libyaml is used
+    [(line, message)] = check("options: {}\nprotocol: [\n")
+    assert line == 3 and message
+
+
+def test_not_a_protocol():
+    assert check("options: {}\n") == [(None, "expected a mapping with a !Protocol under 'protocol'")]
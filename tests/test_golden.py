@@ -0,0 +1,35 @@
+"""Compare the output for docs/examples with the files in tests/golden.
+
+After an intended change of the output, regenerate them with
+
+    ANNEX_UPDATE_GOLDEN=1 python -m pytest tests/test_golden.py
+"""
+import os
+
+import pytest
+
+import annexlang
+from annexlang.convert import load_custom_objects
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), '..', 'docs', 'examples')
+GOLDEN = os.path.join(os.path.dirname(__file__), 'golden')
+
+VARIANTS = {
+    'default': {},
+    'sparse': {'sparse_matrix': True},
+    'paginated': {'page_budget': 150},
+    'stable_ids': {'stable_ids': True},
+}
+
+
+@pytest.mark.parametrize('variant', VARIANTS)
+def test_demo(variant):
+    load_custom_objects(EXAMPLES)
+    with open(os.path.join(EXAMPLES, 'demo.yml')) as f:
+        tikz = annexlang.render(f.read(), **VARIANTS[variant])
+    filename = os.path.join(GOLDEN, f'demo-{variant}.tex')
+    if os.environ.get('ANNEX_UPDATE_GOLDEN'):
+        with open(filename, 'w') as f:
+            f.write(tikz)
+    with open(filename) as f:
+        assert tikz == f.read()
@@ -0,0 +1,89 @@
+import os
+
+import pytest
+import yaml
+
+from annexlang.cache import BuildCache, ParseCache
+from annexlang.check import check
+from annexlang.convert import convert, find_inputs
+from annexlang.loader import load
+from annexlang.tikzpicture import TikzPicture
+
+LOGIN = """parties:
+  browser: &browser !Party {name: Browser}
+  idp: &idp !Party {name: IdP}
+fragment:
+  !Serial
+  steps:
+    - !msg {src: *browser, dest: *idp, caption: login, id: start}
+"""
+
+PROTOCOL = """options: {styles: [!style-default {}]}
+protocol: !Protocol
+  parties:
+  - &a !Party {name: A}
+  - &b !Party {name: B}
+  steps:
+  - !Parallel {steps: [!start-party {party: *a}, !start-party {party: *b}]}
+%s
+  - !Parallel {steps: [!end-party {party: *a}, !end-party {party: *b}]}
+"""
+
+TWICE = """
+  - !include {file: login.yml, parties: {browser: *a, idp: *b}}
+  - !include {file: login.yml, parties: {browser: *b, idp: *a}, as: again}
+"""
+
+
+def write(directory, name, text):
+    filename = os.path.join(str(directory), name)
+    with open(filename, 'w') as f:
+        f.write(text)
+    return filename
+
+
+def test_ids_per_inclusion(tmp_path):
+    write(tmp_path, 'login.yml', LOGIN)
+    protocol = TikzPicture(load(PROTOCOL % TWICE, str(tmp_path)), {'stable_ids': True}).protocol
+    assert [step.id for step in protocol.walk() if getattr(step, 'id', False)] == ['login1-start', 'again-start']
+    assert check(PROTOCOL % TWICE, str(tmp_path)) == []
+
+
+def test_include_cycle(tmp_path):
+    write(tmp_path, 'loop.yml', LOGIN.replace("caption: login, id: start}", "caption: login}\n    - !include {file: loop.yml, parties: {browser: *browser, idp: *idp}}"))
+    with pytest.raises(yaml.MarkedYAMLError, match='includes itself'):
+        load(PROTOCOL % "  - !include {file: loop.yml, parties: {browser: *a, idp: *b}}", str(tmp_path))
+
+
+def test_undeclared_party(tmp_path):
+    write(tmp_path, 'stray.yml', LOGIN.replace('dest: *idp', 'dest: !Party {name: Stray}'))
+    with pytest.raises(yaml.MarkedYAMLError, match="party 'Stray', which is not declared"):
+        load(PROTOCOL % "  - !include {file: stray.yml, parties: {browser: *a, idp: *b}}", str(tmp_path))
+
+
+def test_check_reports_fragment_lines(tmp_path):
+    write(tmp_path, 'login.yml', LOGIN.replace('caption: login', 'caption: login, style: annex_nope'))
+    problems = check(PROTOCOL % "  - !include {file: login.yml, parties: {browser: *a, idp: *b}}", str(tmp_path))
+    assert problems == [(8, f"unknown style 'annex_nope' in style (in {tmp_path}/login.yml, line 7)")]
+
+
+def test_fragment_edits_invalidate_caches(tmp_path):
+    write(tmp_path, 'login.yml', LOGIN)
+    infile = write(tmp_path, 'a.yml', PROTOCOL % TWICE)
+    outfile = infile + '.tex'
+    kwargs = {'cache': BuildCache(), 'parse_cache': ParseCache()}
+    assert convert(infile, outfile, **kwargs)
+    includes = {}
+    assert not convert(infile, outfile, includes=includes, **kwargs)
+    assert list(includes) == [os.path.join(str(tmp_path), 'login.yml')]
+    write(tmp_path, 'login.yml', LOGIN.replace('caption: login', 'caption: logout'))
+    assert convert(infile, outfile, **kwargs)
+    with open(outfile) as f:
+        assert 'logout' in f.read()
+
+
+def test_find_inputs_skips_fragments(tmp_path):
+    write(tmp_path, 'login.yml', LOGIN)
+    infile = write(tmp_path, 'a.yml', PROTOCOL % TWICE)
+    assert find_inputs([str(tmp_path)]) == [infile]
+    assert find_inputs([os.path.join(str(tmp_path), '*.yml')]) == [infile]
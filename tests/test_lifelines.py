@@ -0,0 +1,56 @@
+from annexlang.loader import load
+from annexlang.tikzpicture import TikzPicture
+
+PROTOCOL = """
+options: {}
+protocol: !Protocol
+  parties:
+  - &a !Party {name: A}
+  - &b !Party {name: B}
+  steps:
+  - !Parallel {steps: [!start-party {party: *a}, !start-party {party: *b}]}
+  - !msg {src: *a, dest: *b}
+%s
+  - !msg {src: *a, dest: *b}
+  - !Parallel {steps: [!end-party {party: *a}, !end-party {party: *b}]}
+"""
+
+ADJACENT = """
+  - !Serial
+    lifeline_style: annex_lifeline_dashed
+    steps: [!msg {src: *a, dest: *b}, !msg {src: *b, dest: *a}]
+  - !Serial
+    lifeline_style: annex_lifeline_dotted
+    steps: [!msg {src: *a, dest: *b}, !msg {src: *b, dest: *a}]
+"""
+
+NESTED = """
+  - !Serial
+    lifeline_style: annex_lifeline_dashed
+    steps:
+    - !msg {src: *a, dest: *b}
+    - !Serial
+      lifeline_style: annex_lifeline_dotted
+      steps: [!msg {src: *a, dest: *b}, !msg {src: *b, dest: *a}]
+    - !msg {src: *b, dest: *a}
+"""
+
+
+def segments(steps):
+    protocol = TikzPicture(load(PROTOCOL % steps)).protocol
+    return [start.lifeline_segments for start in protocol.lifelines]
+
+
+def test_adjacent_blocks():
+    # Serial.apply_lifeline_style() used to emit a zero-length annex_lifeline
+    # segment (7, 7) between the two blocks; it is not drawn and is left out now.
+    expected = [(0, 3, 'annex_lifeline'), (3, 7, 'annex_lifeline_dashed'),
+                (7, 11, 'annex_lifeline_dotted'), (11, 14, 'annex_lifeline')]
+    assert segments(ADJACENT) == [expected, expected]
+
+
+def test_nested_blocks():
+    # the inner block wins, the outer block continues after it (as before)
+    expected = [(0, 3, 'annex_lifeline'), (3, 5, 'annex_lifeline_dashed'), (5, 9, 'annex_lifeline_dotted'),
+                (9, 11, 'annex_lifeline_dashed'), (11, 14, 'annex_lifeline')]
+    assert segments(NESTED) == [expected, expected]
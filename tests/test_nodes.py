@@ -0,0 +1,25 @@
+from annexlang.nodes import NodeRegistry
+
+
+def test_lookups_between_adds():
+    registry = NodeRegistry(4)
+    registry.add(2, 'c', parties=['p'])
+    registry.add(0, 'a', parties=['p', 'q'])
+    assert registry.step_nodes(0, 4) == ['a', 'c']
+    # nodes added after a lookup are found, in the order in which they were added per step
+    registry.add(2, 'd')
+    registry.add(1, 'b', parties=['q'])
+    assert registry.step_nodes(2) == ['c', 'd']
+    assert registry.step_nodes(0, 4) == ['a', 'b', 'c', 'd']
+    assert registry.step_nodes(1, 3) == ['b', 'c', 'd']
+    assert registry.step_nodes(3) == []
+
+
+def test_party_nodes():
+    registry = NodeRegistry(3)
+    registry.add(0, 'a', parties=['p'])
+    registry.add(2, 'c', parties=['p'])
+    registry.add(1, 'b', parties=['p', 'q'])
+    assert registry.party_nodes('p') == ['a', 'c', 'b']
+    assert registry.party_nodes('p', 1, 3) == ['c', 'b']
+    assert registry.party_nodes('r') == []
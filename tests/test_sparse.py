@@ -0,0 +1,26 @@
+from annexlang.tikzpicture import merge_heights, referenced_positions
+
+
+def test_merge_heights():
+    # the merged node spans all heights and the origin of the row
+    assert merge_heights([('2ex', 'north'), ('3ex', 'south')]) == [('5ex', 'south,yshift=-2ex')]
+    assert merge_heights([('4ex', 'center')]) == [('4ex', 'south,yshift=-2ex')]
+    assert merge_heights([('2ex', 'north,yshift=1ex'), ('1.6ex', 'south,yshift=-1ex')]) == [('2ex', 'south,yshift=-1ex')]
+    assert merge_heights([('2ex+1.6ex', 'north')]) == [('3.6ex', 'south,yshift=-3.6ex')]
+    assert merge_heights([]) == []
+
+
+def test_merge_heights_other_units():
+    # only heights in ex can be merged
+    heights = [('2ex', 'north'), ('1cm', 'south')]
+    assert merge_heights(heights) == heights
+    heights = [('2ex', 'north west')]
+    assert merge_heights(heights) == heights
+
+
+def test_referenced_positions():
+    chunks = [
+        "% drawing node with attributes: {'pos': 'pos-1-2'}\n\\node at (pos-3-4) {};",
+        "\\draw (pos-0-1) -- (pos-2-1); % pos-9-9\n\\node {50\\% (pos-5-6)};",
+    ]
+    assert referenced_positions(chunks) == {'pos-3-4', 'pos-0-1', 'pos-2-1', 'pos-5-6'}
@@ -0,0 +1,43 @@
+import os
+
+from annexlang.convert import write_style_sheet
+from annexlang.styles import split_styles, style_sheet, style_sheet_name
+
+
+def test_split_styles_nested_braces():
+    assert split_styles('a/.style={draw,fill={red,blue}}, b=1') == ['a/.style={draw,fill={red,blue}}', 'b=1']
+
+
+def test_split_styles_comments():
+    # comments may contain commas and braces
+    assert split_styles('% first, {\n a=1,\n % second }\n b=2') == ['a=1', 'b=2']
+    # escaped percent signs are no comments
+    assert split_styles(r'a={50\%, 3}, b=\%') == [r'a={50\%, 3}', r'b=\%']
+
+
+def test_split_styles_parameters():
+    assert split_styles('annex_a/.style={draw=#1}, every node/.style={#1}') == [
+        'annex_a/.style={draw=#1}', 'every node/.style={#1}']
+
+
+def test_style_sheet():
+    styles = 'annex_a/.style={draw=#1}, every node/.style={font=#1}, % comment\n annex_b/.style={annex_a}'
+    name = style_sheet_name(styles)
+    assert style_sheet(styles) == (
+        "\\tikzset{annex_a/.style={draw=#1},\nannex_b/.style={annex_a}}\n"
+        # parameters inside the picture style are doubled
+        f"\\tikzset{{{name}/.style={{every node/.style={{font=##1}}}}}}\n"
+        f"\\def\\annexstylesactive{{{name}}}\n"
+    )
+
+
+def test_style_sheet_index(tmp_path):
+    directory = str(tmp_path)
+    for styles in ('annex_a/.style={}', 'annex_b/.style={}'):
+        write_style_sheet(directory, styles, style_sheet(styles))
+    # a sheet written by another process is picked up by the next call
+    os.remove(os.path.join(directory, 'annexstyles.tex'))
+    write_style_sheet(directory, 'annex_a/.style={}', style_sheet('annex_a/.style={}'))
+    with open(os.path.join(directory, 'annexstyles.tex')) as f:
+        index = f.read().splitlines()
+    assert index == sorted(f"\\input{{{directory}/{style_sheet_name(s)}}}" for s in ('annex_a/.style={}', 'annex_b/.style={}'))